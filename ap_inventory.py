@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+#
+# Author: Wade Wells github/Pack3tL0ss
+#
+# Fleet wide AP inventory, collected from every Conductor and MD concurrently and
+# stored column wise (see common.columnar) for fast group-by reporting.
+#
+import argparse
+import asyncio
+import time
+from typing import TYPE_CHECKING, AsyncIterator, Dict, List
+
+from common import config, log, parse
+from common.columnar import APInventory
+from common.device import APRecord
+
+if TYPE_CHECKING:
+    from common.async_client import AsyncAosPool
+
+INVENTORY_DIR = config.cache_dir / "ap_inventory"
+AP_CMD = "show ap database long"
+
+
+class APCollector:
+    def __init__(self, conductors: List[str], port: int = 4343, limit: int = None):
+        """Collects show ap database long from every Conductor and MD.
+
+        Args:
+            conductors (List[str]): Conductors, MDs are discovered from their show switches.
+            port (int, optional): API port. Defaults to 4343.
+            limit (int, optional): Max simultaneous API connections. Defaults to config workers.
+        """
+        self.conductors = conductors
+        self.port = port
+        self.limit = limit or config.workers
+        self.failed: Dict[str, str] = {}
+
+    def collect(self) -> APInventory:
+        return asyncio.run(self._collect())
+
+    async def _collect(self) -> APInventory:
+        from common.async_client import AsyncAosPool  # aiohttp, not needed for --report
+
+        _start = time.perf_counter()
+        async with AsyncAosPool(config.user, config.password, self.port, limit=self.limit) as pool:
+            controllers = await self._discover(pool)
+            results = await asyncio.gather(*[self._ap_database(pool, ip) for ip in controllers])
+
+        # Conductors and MDs can both report the same AP, first report (by name) wins
+        seen = set()
+        records: List[APRecord] = []
+        for aps in results:
+            for ap in aps:
+                if ap.name not in seen:
+                    seen.add(ap.name)
+                    records.append(ap)
+        inv = APInventory.from_records(records)
+        log.info(
+            f"AP inventory: {len(inv)} APs from {len(controllers) - len(self.failed)}/{len(controllers)} controllers "
+            f"in {time.perf_counter() - _start:.2f}s", show=True
+        )
+        return inv
+
+    async def _discover(self, pool: "AsyncAosPool") -> List[str]:
+        """Conductors followed by every MD found in their show switches (de-duplicated, order preserved)."""
+        res = await pool.batch([(ip, "show switches") for ip in self.conductors])
+        controllers = dict.fromkeys(self.conductors)
+        for ip, r in zip(self.conductors, res):
+            if not r.ok:
+                log.error(f"{ip}: show switches failed {r.error}", show=True)
+                continue
+            # APs are queried on the MDs, conductors (and their standby/VRRP entries) are only queried as configured
+            controllers.update(dict.fromkeys(
+                md_ip for md_ip, switch in parse.show_switches(r.json()).items() if switch.get("Type") == "MD"
+            ))
+        return list(controllers)
+
+    async def _ap_database(self, pool: "AsyncAosPool", ip: str) -> List[APRecord]:
+        # parsed as the body streams in, the (large) response is never decoded whole
+        r = await pool.stream_command(ip, AP_CMD, _collect_aps)
+        if not r.ok:
+            self.failed[ip] = str(r.error)
+            log.error(f"{ip}: {AP_CMD} failed {r.error}", show=True)
+            return []
+        return r.text
+
+
+async def _collect_aps(chunks: AsyncIterator[bytes]) -> List[APRecord]:
+    return [ap async for ap in parse.iter_ap_database(chunks)]
+
+
+def report(inv: APInventory) -> None:
+    """Print count of down APs per group per switch."""
+    counts = inv.count_by("group", "switch_ip", where={"status": "Down"})
+    log.flush()
+    if not counts:
+        print(f"No down APs ({len(inv)} APs in inventory)")
+        return
+    print(f"{'Group':<32} {'Switch IP':<16} Down")
+    for (group, switch_ip), n in sorted(counts.items(), key=lambda i: (-i[1], str(i[0]))):
+        print(f"{str(group):<32} {str(switch_ip):<16} {n}")
+    print(f"{sum(counts.values())} of {len(inv)} APs down")
+
+
+if __name__ == "__main__":
+    log.info(f" {'-' * 10 } Script Startup {'-' * 20 }")
+    parser = argparse.ArgumentParser(description="Collect AP inventory from every controller and report down APs per group/switch")
+    parser.add_argument("--report", action="store_true",
+                        help="Report from the last stored inventory without collecting")
+    args = parser.parse_args()
+    if args.report:
+        inv = APInventory.load(INVENTORY_DIR, columns=("group", "switch_ip", "status", "name"))
+    elif config.conductors:
+        inv = APCollector(config.conductors).collect()
+        inv.save(INVENTORY_DIR)
+    else:
+        print('No Data, Check config.yaml')
+        raise SystemExit(1)
+    report(inv)
@@ -4,28 +4,27 @@
 #
 # Version 0.1
 #
-from typing import Union, Any, List
+from typing import Union, Any, List, Tuple
 
-import socket
+import ipaddress
 import threading
 import time
-from rich.console import Console
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
 
-import aiohttp
 import asyncio
-from netmiko.aruba import ArubaOsSSH
-from netmiko.exceptions import NetmikoTimeoutException
 
-from common import config, log, Response
-from common.models import APDBModel
+# netmiko (paramiko), rich and aiohttp are imported where used, a run with no down APs never loads netmiko
+from common import config, log, metrics, parse, Response
 
 LOCK = threading.Lock()
+# per batch (set in _batch_request, inherited by its tasks), an asyncio.Semaphore belongs to the loop it's used in
+_ssh_sem: ContextVar[asyncio.Semaphore] = ContextVar("_ssh_sem", default=None)
 COUNT = 3
 controllers = ''
 port = ''
 outfile = 'results.csv'
 outfile2 = 'results.txt'
-config = config.config
 
 headers = {
     "Content-Type": "application/json",
@@ -38,6 +37,67 @@ class SSHResponse:
         self.cmd = cmd
         self.response = stdout if stdout is not None else stderr
         self.error = stderr
+        self.ok = not stderr
+
+    def __str__(self):
+        return str(self.response)
+
+
+def _call_ok(res: Any) -> bool:
+    """Determine success of a single call in a batch (Response/SSHResponse/ProbeResult/bool)."""
+    if isinstance(res, Exception):
+        return False
+    for attr in ("ok", "reachable"):
+        if hasattr(res, attr):
+            return bool(getattr(res, attr))
+    return bool(res)
+
+
+class BatchResponse(Response):
+    def __init__(self, responses: List[Any], timings: List[float], elapsed: float, aborted: str = None):
+        """Aggregate result of a batch of calls.
+
+        Args:
+            responses (List[Any]): Result of each call in call order, None for calls not made (aborted).
+            timings (List[float]): Seconds each call took, None for calls not made.
+            elapsed (float): Wall clock seconds for the whole batch.
+            aborted (str, optional): Reason the batch was aborted early. Defaults to None.
+        """
+        self.responses = responses
+        self.timings = timings
+        self.elapsed = elapsed
+        self.aborted = aborted
+        self.passed = [r for r in responses if r is not None and _call_ok(r)]
+        self.failed = [r for r in responses if r is not None and not _call_ok(r)]
+        self.not_run = len([r for r in responses if r is None])
+        super().__init__(ok=not self.failed and not aborted, output=self.output, error=aborted)
+
+    def __iter__(self):
+        return iter(self.responses)
+
+    def __len__(self):
+        return len(self.responses)
+
+    def __getitem__(self, idx):
+        return self.responses[idx]
+
+    @property
+    def output(self) -> str:
+        """Merged output of all calls made."""
+        return "\n".join([str(r) for r in self.responses if r is not None])
+
+    @property
+    def throughput(self) -> float:
+        """Calls completed per second."""
+        done = len(self.passed) + len(self.failed)
+        return 0 if not self.elapsed else done / self.elapsed
+
+    def __str__(self):
+        ret = (
+            f"{len(self.passed)} ok, {len(self.failed)} failed, {self.not_run} not run "
+            f"in {self.elapsed:.2f}s ({self.throughput:.1f}/s)"
+        )
+        return ret if not self.aborted else f"{ret} Aborted: {self.aborted}"
 
 
 class BatchRequest:
@@ -60,22 +120,94 @@ class BatchRequest:
         return f"<{self.__module__}.{type(self).__name__} ({self.func.__name__}) object at {hex(id(self))}>"
 
 
-async def is_reachable(host: str, port: Union[str, list], timeout: int = 2, silent: bool = True):
-    s = socket.socket()
+class ProbeResult:
+    def __init__(self, host: str, port: int, reachable: bool, latency: float = None, error: str = None):
+        self.host = host
+        self.port = port
+        self.reachable = reachable
+        self.latency = latency  # seconds to establish the TCP connection
+        self.error = error
+
+    def __repr__(self):
+        return f"<{type(self).__name__} ({self.host}:{self.port} {'up' if self.reachable else 'down'}) object at {hex(id(self))}>"
+
+
+def _unusable_address(host: str) -> str:
+    """Why host can't be an AP's address (None if it can), down APs often report 0.0.0.0 which connects locally."""
+    try:
+        addr = ipaddress.ip_address(host)
+    except ValueError:
+        return f"invalid address {host!r}"
+    if addr.is_unspecified or addr.is_loopback or addr.is_multicast:
+        return f"unusable address {host}"
+    return None
+
+
+async def probe(host: str, port: int = 22, timeout: float = 2) -> ProbeResult:
+    """TCP connect probe, non-blocking.  Unspecified, loopback and invalid addresses are unreachable without probing."""
+    error = _unusable_address(host)
+    if error:
+        return ProbeResult(host, port, False, error=error)
+    _start = time.perf_counter()
     try:
-        s.settimeout(timeout)
-        s.connect((host, port))
-        _reachable = True
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    except asyncio.TimeoutError:
+        return ProbeResult(host, port, False, error=f"timeout after {timeout}s")
     except Exception as e:
-        if not silent:
-            print("something's wrong with %s:%d. Exception is %s" % (host, port, e))
-        _reachable = False
-    finally:
-        s.close()
-    return _reachable
+        return ProbeResult(host, port, False, error=f"{e.__class__.__name__} {e}")
+    latency = time.perf_counter() - _start
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except Exception:
+        pass
+    return ProbeResult(host, port, True, latency)
+
+
+async def is_reachable(host: str, port: int = 22, timeout: int = 2, silent: bool = True) -> bool:
+    res = await probe(host, port, timeout)
+    if not res.reachable and not silent:
+        print("something's wrong with %s:%d. Exception is %s" % (host, port, res.error))
+    return res.reachable
+
+
+async def probe_reachability(targets: List[Tuple[str, int]], limit: int = 500, timeout: float = 2, deadline: float = 30) -> List[ProbeResult]:
+    """Probe many ip:port targets concurrently.
+
+    Args:
+        targets (List[Tuple[str, int]]): (host, port) to probe.
+        limit (int, optional): Max probes in flight at once. Defaults to 500.
+        timeout (float, optional): Connect timeout for each probe. Defaults to 2.
+        deadline (float, optional): Overall deadline, probes not complete by then are
+            reported unreachable. Defaults to 30.
+
+    Returns:
+        List[ProbeResult]: Result for each target in the order provided.
+    """
+    sem = asyncio.Semaphore(limit)
+
+    async def _probe(host: str, port: int) -> ProbeResult:
+        async with sem:
+            return await probe(host, port, timeout)
+
+    _start = time.perf_counter()
+    tasks = [asyncio.ensure_future(_probe(host, port)) for host, port in targets]
+    if not tasks:
+        return []
+    _, pending = await asyncio.wait(tasks, timeout=deadline)
+    for task in pending:
+        task.cancel()
+    res = [
+        t.result() if t not in pending else ProbeResult(host, port, False, error=f"not probed within {deadline}s deadline")
+        for t, (host, port) in zip(tasks, targets)
+    ]
+    log.debug(f"probed {len(targets)} targets in {time.perf_counter() - _start:.2f}, {len([r for r in res if r.reachable])} reachable.")
+    return res
 
 
 class AP:
+    __slots__ = ("name", "ip", "reachable", "cmd", "response")
+
     def __init__(self, name: str, ip: str, reachable: bool = None):
         self.name = name
         self.ip = ip
@@ -92,112 +224,233 @@ class AP:
 
 class AosConnect(Response):
 
-    def __init__(self, port: int = 4343):
+    def __init__(self, port: int = 4343, ssh_concurrency: int = None, ssh_timeout: int = None, conductors: List[str] = None):
         self.port = port
-        self.user = config["user"]
-        self.password = config["pass"]
+        self.user = config.user
+        self.password = config.password
         self.handle = None
         self.output = ''
-        self.ip = config["conductors"][-1]  # script built to only expect a single conductor currently
+        self.conductors = conductors or config.conductors
+        self.ip = self.conductors[-1]
+        self.ssh_concurrency = ssh_concurrency or config.ssh_concurrency
+        self.ssh_timeout = ssh_timeout or config.ssh_timeout
+        self._ssh_pool = ThreadPoolExecutor(max_workers=self.ssh_concurrency, thread_name_prefix="ssh")
 
     def down_aps(self) -> List[AP]:
-        return asyncio.run(self.get_down_aps())
+        return asyncio.run(self.get_all_down_aps())
 
-    async def get_down_aps(self) -> object:
-        """
-        This function will login into the controller using API.
-        :return: connection handle for the device.
+    async def get_all_down_aps(self) -> List[AP]:
+        """Query every conductor concurrently and merge the results.
+
+        APs are de-duplicated by name (the first conductor in config to report an AP wins), not by IP
+        as down APs often report a stale or 0.0.0.0 address,
+        conductors that fail are logged and skipped.
+
+        Returns:
+            List[AP]: Combined list of down APs.
         """
+        _start = time.perf_counter()
+        results = await asyncio.gather(*[self.get_down_aps(ip) for ip in self.conductors], return_exceptions=True)
+        merged: List[AP] = []
+        names = set()
+        for ip, res in zip(self.conductors, results):
+            if isinstance(res, (str, Exception)) or res is None:
+                log.error(f"{ip}: Unable to retrieve down APs {res.__class__.__name__ if isinstance(res, Exception) else ''} {res}", show=True)
+                continue
+            for ap in res:
+                if ap.name not in names:
+                    names.add(ap.name)
+                    merged.append(ap)
+        log.debug(f"down APs from {len(self.conductors)} conductors took {time.perf_counter() - _start:.2f}, {len(merged)} unique.")
+        return merged
+
+    async def get_down_aps(self, ip: str = None) -> Union[List[AP], str]:
+        """Get down APs from a single conductor.
+
+        Args:
+            ip (str, optional): conductor to query. Defaults to the last conductor in config.
 
-        base_url = f"https://{self.ip}:{self.port}"
+        Returns:
+            Union[List[AP], str]: Down APs, or the error text if the request failed.
+        """
+        ip = ip or self.ip
+        base_url = f"https://{ip}:{self.port}"
         payload = {'username': self.user, 'password': self.password}
 
-        if self.ip:
-            async with aiohttp.ClientSession(base_url=base_url, ) as session:
+        if ip:
+            import aiohttp
+
+            async with aiohttp.ClientSession(base_url=base_url, cookie_jar=aiohttp.CookieJar(unsafe=True)) as session:
                 con = await session.post("/v1/api/login", data=payload, headers=headers, ssl=False)
                 uuid = con.headers["Set-Cookie"].split(';')[0].split('=')[1]
 
                 res = await session.get("/v1/configuration/showcommand", headers=headers, params={"UIDARUBA": uuid, "command": "show ap database status down"}, ssl=False)
 
+                if not res.ok:
+                    return await res.text()
+                # parsed as the body streams in, no full json decode / model validation of the whole db
                 try:
-                    res_data = await res.json()
-                    res_data = APDBModel(**res_data)
-                    r = [AP(name=ap.name, ip=ap.ip) for ap in res_data.ap_database]
-                    return r
-                except Exception:
-                    res_data = await res.text()
-                    return res_data
+                    return [AP(name=ap.name, ip=ap.ip) async for ap in parse.iter_ap_database(res.content.iter_chunked(65536))]
+                except Exception as e:
+                    log.error(f"{ip}: Error parsing show ap database response {e.__class__.__name__} {e}")
+                    return f"Error parsing show ap database response from {ip}: {e}"
+
+    def _ssh_send(self, host: str, user: str, psswd: str, cmd: List[str], expect_string: str = None) -> str:
+        """Blocking netmiko session, ran in the ssh thread pool."""
+        from netmiko.aruba import ArubaOsSSH
+
+        with metrics.timer("netmiko_connect", host):
+            ssh = ArubaOsSSH(host=host, username=user, password=psswd, timeout=3,)
+        try:
+            with metrics.timer("netmiko", host, "; ".join(cmd)) as call:
+                out = ssh.send_command("\n".join(cmd), expect_string=expect_string, read_timeout=self.ssh_timeout)
+                call.bytes = len(out)
+            return out
+        finally:
+            try:
+                ssh.disconnect()
+            except Exception:
+                pass  # expected when the command (i.e. reload) drops the session
 
     async def ssh_run_command(self, host: str, user: str, psswd: str, cmd: Union[str, List[str]], expect_string: str = None) -> SSHResponse:
+        """Run command(s) on host via SSH.
+
+        The blocking netmiko session runs in a thread pool, so calls gathered together run
+        concurrently, up to ssh_concurrency at a time, each bounded by ssh_timeout.
+        """
+        from netmiko.exceptions import NetmikoTimeoutException, ReadTimeout
+        from rich.console import Console
+
         cmd = cmd if isinstance(cmd, list) else [cmd]
         cmd = [c.strip() for c in cmd]
-        try:
-            ssh = ArubaOsSSH(host=host, username=user, password=psswd, timeout=3,)
-            cmd_res = ssh.send_command("\n".join(cmd), expect_string=expect_string)
-            cmd_res.replace(expect_string, f"[bright_green]{expect_string}[/]")
-        except NetmikoTimeoutException:
-            cmd_res = f"[bright_red]Unable to connect to {host}[/]"
+        sem = _ssh_sem.get() or asyncio.Semaphore(self.ssh_concurrency)  # outside a batch only the pool bounds concurrency
+        error = None
+        async with sem:
+            loop = asyncio.get_running_loop()
+            try:
+                cmd_res = await asyncio.wait_for(
+                    loop.run_in_executor(self._ssh_pool, self._ssh_send, host, user, psswd, cmd, expect_string),
+                    timeout=self.ssh_timeout + 5,  # allow for connection setup on top of read_timeout
+                )
+                if expect_string:
+                    cmd_res = cmd_res.replace(expect_string, f"[bright_green]{expect_string}[/]")
+            except NetmikoTimeoutException:
+                cmd_res = error = f"[bright_red]Unable to connect to {host}[/]"
+            except (asyncio.TimeoutError, ReadTimeout):
+                cmd_res = error = f"[bright_red]Timeout waiting for response from {host}[/]"
+            except Exception as e:
+                cmd_res = error = f"[bright_red]{host}: {e.__class__.__name__} {e}[/]"
 
         confirm_strings = ["yes", "y"]
         cmd = [c.rstrip("\ny").rstrip("\nY").rstrip("\nyes").rstrip("\nYES") for c in cmd if c.lower() not in confirm_strings]
+        last_line = (cmd_res.splitlines() or [""])[-1]
         console = Console(emoji=False)
-        console.print(f"{host}: {cmd} -> {cmd_res.splitlines()[-1]}")
-        return SSHResponse(cmd_res.splitlines()[-1], cmd="; ".join(cmd))
+        console.print(f"{host}: {cmd} -> {last_line}")
+        return SSHResponse(None if error else last_line, error, cmd="; ".join(cmd))
 
-    async def _batch_request(self, api_calls: List[BatchRequest]) -> List[Response]:
-        # self.silent = True
+    async def _batch_request(
+        self, api_calls: List[BatchRequest], concurrency: int = 50, max_error_rate: float = 0.5, min_sample: int = 10
+    ) -> BatchResponse:
         _start = time.perf_counter()
-        _api_calls = [call.func(*call.args, **call.kwargs) for call in api_calls]
-
-        m_resp = await asyncio.gather(*_api_calls)
-        _elapsed = time.perf_counter() - _start
-        log.debug(f"batch of {len(api_calls)} took {_elapsed:.2f}.")
-
-        return m_resp
-
-    # TODO return a BatchResponse object (subclass Response) where OK indicates all OK
-    # and method that returns merged output from all resp...
-    def batch_request(self, api_calls: List[BatchRequest], progress_msg: str = None) -> List[Response]:
+        responses: List[Any] = [None] * len(api_calls)
+        timings: List[float] = [None] * len(api_calls)
+        sem = asyncio.Semaphore(concurrency)
+        _ssh_sem.set(asyncio.Semaphore(self.ssh_concurrency))  # created in this batch's loop
+        aborted = None
+
+        async def _call(idx: int) -> Any:
+            async with sem:
+                if aborted:  # not started before the abort, left as None (not run)
+                    return None
+                call = api_calls[idx]
+                _call_start = time.perf_counter()
+                try:
+                    responses[idx] = await call.func(*call.args, **call.kwargs)
+                except Exception as e:
+                    responses[idx] = e
+                timings[idx] = time.perf_counter() - _call_start
+                return responses[idx]
+
+        def _done(aborted: str = None) -> BatchResponse:
+            batch = BatchResponse(responses, timings, time.perf_counter() - _start, aborted=aborted)
+            log.debug(f"batch of {len(api_calls)}: {batch}")
+            return batch
+
+        if not api_calls:
+            return _done()
+
+        # canary, a bad credential or command fails here once rather than across every device
+        if not _call_ok(await _call(0)):
+            return _done(f"first call failed ({responses[0]}), remaining {len(api_calls) - 1} calls not made")
+
+        tasks = [asyncio.ensure_future(_call(idx)) for idx in range(1, len(api_calls))]
+        completed = failed = 0
+        for fut in asyncio.as_completed(tasks):
+            res = await fut
+            completed += 1
+            failed += not _call_ok(res)
+            if max_error_rate is not None and completed >= min_sample and failed / completed > max_error_rate:
+                aborted = f"error rate {failed}/{completed} exceeded {max_error_rate:.0%}"
+                break
+        if aborted:
+            # calls still waiting for a slot return without running, those already running (netmiko in the
+            # ssh pool, can't be interrupted) are waited on so their outcome is reported rather than "not run"
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        return _done(aborted)
+
+    def batch_request(
+        self, api_calls: List[BatchRequest], progress_msg: str = None, concurrency: int = 50, max_error_rate: float = 0.5
+    ) -> BatchResponse:
         """non async to async wrapper for multiple parallel API calls
 
         First entry is ran alone, if successful the remaining calls
-        are made in parallel.
+        are made in parallel (up to concurrency at a time).  The batch is aborted
+        if the error rate exceeds max_error_rate (after at least 10 calls complete),
+        calls not yet started are not made, calls already running are allowed to finish.
 
         Args:
             api_calls (List[BatchRequest]): List of BatchRequest objects.
             progress_msg (Optional str): message to display with progress spinner.
+            concurrency (int, optional): Max calls in flight at once. Defaults to 50.
+            max_error_rate (float, optional): Abort remaining calls once the failure rate exceeds
+                this (0 - 1). None disables. Defaults to 0.5.
 
         Returns:
-            List[Response]: List of aosapi.response.Response objects.
+            BatchResponse: Aggregate result, iterates over the individual responses in call order.
         """
         if progress_msg:
+            from rich.console import Console
+
             console = Console(emoji=False)
             with console.status(progress_msg):
-                return asyncio.run(self._batch_request(api_calls))
+                return asyncio.run(self._batch_request(api_calls, concurrency=concurrency, max_error_rate=max_error_rate))
         else:
-            return asyncio.run(self._batch_request(api_calls))
+            return asyncio.run(self._batch_request(api_calls, concurrency=concurrency, max_error_rate=max_error_rate))
 
 
 if __name__ == "__main__":
     log.info(f" {'-' * 10 } Script Startup {'-' * 20 }")
     x = AosConnect()
     br = BatchRequest
-    console = Console(emoji=False)
-    down_aps = asyncio.run(x.get_down_aps())
+    down_aps = x.down_aps()
+    log.flush()  # errors from the conductors print before the results
     if down_aps:
-        # reachable_reqs = [br(is_reachable, (ap.ip, 22)) for ap in down_aps]
-        # reachable_resp = x.batch_request(reachable_reqs, progress_msg=f"Checking reachability for {len(down_aps)} APs")
-        # _ = [setattr(ap, "reachable", reachable) for ap, reachable in zip(down_aps, reachable_resp)]
-
-        # reboot_calls = [br(x.ssh_run_command, (ap.ip,), user="wade", psswd="hpIMC!!!", cmd="reload\ny\n", expect_string="Reloading") for ap in down_aps if ap.reachable]
-        reboot_calls = [br(x.ssh_run_command, (ap.ip,), user=config["user"], psswd=config["pass"], cmd="reload\ny\n", expect_string="Reloading") for ap in down_aps]
-        reboot_res = x.batch_request(reboot_calls, progress_msg=f"rebooting {len(down_aps)} APs")
-        pass
-        # reboot_res = x.batch_request(reboot_calls, progress_msg=f"rebooting {len([ap for ap in down_aps if ap.reachable])} reachable APs")
-
-        # skipped_calls = [SSHResponse(f"Device {ap.name} @ {ap.ip} is not reachable", cmd="reload") for ap, reachable in zip(down_aps, reachable_resp) if not reachable]
-        # total_res = [*skipped_calls, *reboot_res]
+        from rich.console import Console
 
-        # console.print(total_res)
+        console = Console(emoji=False)
+        with console.status(f"Checking reachability for {len(down_aps)} APs"):
+            probes = asyncio.run(probe_reachability([(ap.ip, 22) for ap in down_aps]))
+        _ = [setattr(ap, "reachable", res.reachable) for ap, res in zip(down_aps, probes)]
+        reachable_aps = [ap for ap in down_aps if ap.reachable]
+
+        reboot_calls = [br(x.ssh_run_command, (ap.ip,), user=config.user, psswd=config.password, cmd="reload\ny\n", expect_string="Reloading") for ap in reachable_aps]
+        if reboot_calls:
+            reboot_res = x.batch_request(reboot_calls, progress_msg=f"rebooting {len(reachable_aps)} reachable APs")
+            console.print(f"Reboot: {reboot_res}")
+
+        skipped = [f"{ap.name} @ {ap.ip} is not reachable ({res.error})" for ap, res in zip(down_aps, probes) if not res.reachable]
+        if skipped:
+            console.print(f"Skipped {len(skipped)} unreachable APs:", *skipped, sep="\n  ")
     else:
-        console.print("No down APs")
+        print("No down APs")
@@ -0,0 +1 @@
+"""Benchmarks, run from the repo root i.e. python -m benchmarks.parse_image_version"""
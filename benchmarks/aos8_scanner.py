@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+#
+# Author: Wade Wells github/Pack3tL0ss
+"""Prompt detection + output cleanup cost for large captured CLI output.
+
+Feeds synthetic "show ap database long" style output in 64K chunks (as
+AOS8SSHClient.aos8execute receives it) through common.aos8.PromptScanner and
+clean_output, and through the original implementation which re-scans the
+whole buffer after every chunk (kept here for reference).
+
+    python -m benchmarks.aos8_scanner [--mb 4]
+"""
+import argparse
+import re
+import time
+
+from common import aos8
+
+COMMAND = "show ap database long"
+PROMPT = "(mc01) [mynode] #"
+LINE = "ap-{idx:06d}  AP-535  default  10.{a}.{b}.{c}  Up  12d:3h:4m:5s  {flags}  10.0.0.1  0.0.0.0  aa:bb:cc:dd:ee:ff  CNXXXXXX\r\n"
+
+
+def legacy_is_contain_prompt(input_str: str = "") -> bool:
+    input_str = input_str.replace('\r', '')
+
+    if re.search(r'^\([a-zA-Z0-9\-\_]*\) [\^\*]{0,2}\[[a-zA-Z0-9\-\_]*\] [\^\*]{0,2}\(?[a-zA-Z0-9\-\_]*\)?\s?#', input_str, re.MULTILINE):
+        return True
+    elif re.search(r'^\([a-zA-Z0-9\-\_]*\) [\^\*]{0,2}\s?#', input_str, re.MULTILINE):
+        return True
+    else:
+        return False
+
+
+def legacy_clean_output(output: str, command: str = ""):
+    output = output.replace('\r', '')
+    lines = output.splitlines(True)
+    clean_output = []
+
+    for line in lines:
+        if legacy_is_contain_prompt(line):
+            pass
+        elif command != "" and re.search(command, line, re.MULTILINE):
+            pass
+        else:
+            clean_output.append(line.rstrip())
+
+    return "\n".join(clean_output)
+
+
+def legacy(chunks: list) -> str:
+    data = ""
+    for buffer in chunks:
+        data += buffer.decode()
+        if legacy_is_contain_prompt(data):
+            break
+    return legacy_clean_output(data, COMMAND)
+
+
+def streaming(chunks: list) -> str:
+    scanner = aos8.PromptScanner()
+    for buffer in chunks:
+        if scanner.feed(buffer.decode()):
+            break
+    return aos8.clean_output(scanner.data, COMMAND)
+
+
+def capture(mb: float) -> bytes:
+    lines = [f"{COMMAND}\r\n", "AP Database\r\n", "-----------\r\n"]
+    size, idx = 0, 0
+    while size < mb * 1024 * 1024:
+        line = LINE.format(idx=idx, a=idx >> 16 & 255, b=idx >> 8 & 255, c=idx & 255, flags="2" if idx % 7 else "")
+        lines.append(line)
+        size += len(line)
+        idx += 1
+    lines.append(f"\r\nTotal APs:{idx}\r\n{PROMPT}")
+    return "".join(lines).encode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mb", type=float, default=4)
+    args = parser.parse_args()
+
+    raw = capture(args.mb)
+    chunks = [raw[i:i + 65535] for i in range(0, len(raw), 65535)]
+    print(f"{len(raw) / 1024 / 1024:.1f} MB in {len(chunks)} chunks")
+
+    results = {}
+    for name, func in (("legacy (rescan whole buffer)", legacy), ("PromptScanner (tail only)", streaming)):
+        start = time.perf_counter()
+        results[name] = func(chunks)
+        print(f"{name:<30} {time.perf_counter() - start:8.3f} s")
+    assert len(set(results.values())) == 1, "outputs differ"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+#
+# Author: Wade Wells github/Pack3tL0ss
+"""Time and peak memory to turn a large show ap database response into AP records.
+
+Compares the original path (full json decode -> APDBModel validation -> AP
+objects) with common.parse.APDatabaseParser fed the body in 64K chunks, with
+and without pydantic validation.
+
+    python -m benchmarks.ap_database [--aps 20000]
+"""
+import argparse
+import json
+import time
+import tracemalloc
+
+from common import parse
+from common.models import APDBModel
+
+
+class AP:
+    def __init__(self, name: str, ip: str):
+        self.name = name
+        self.ip = ip
+
+
+def body(count: int) -> bytes:
+    aps = [
+        {
+            "AP Type": "AP-535", "Flags": "2", "Group": f"group-{i % 50}", "IP Address": f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}",
+            "Name": f"ap-{i:06d}", "Standby IP": "0.0.0.0", "Status": "Down", "Switch IP": f"10.255.0.{i % 8}",
+        }
+        for i in range(count)
+    ]
+    return json.dumps({"AP Database": aps, "_data": [], "_meta": ["Flags"]}).encode()
+
+
+def model(raw: bytes) -> list:
+    chunks = [raw[i:i + 65536] for i in range(0, len(raw), 65536)]  # aiohttp buffers these into the full body
+    res_data = APDBModel(**json.loads(b"".join(chunks)))
+    return [AP(name=ap.name, ip=ap.ip) for ap in res_data.ap_database]
+
+
+def stream(raw: bytes, validate: bool = False) -> list:
+    parser = parse.APDatabaseParser(validate=validate)
+    return [ap for i in range(0, len(raw), 65536) for ap in parser.feed(raw[i:i + 65536])]
+
+
+def measure(name: str, func, raw: bytes, repeat: int = 3) -> None:
+    # timed without tracemalloc (it slows allocation heavy code considerably), then traced for peak memory
+    elapsed = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        res = func(raw)
+        elapsed.append(time.perf_counter() - start)
+    del res
+    tracemalloc.start()
+    res = func(raw)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<34} {min(elapsed) * 1000:8.1f} ms  peak {peak / 1024 / 1024:7.1f} MB  ({len(res)} APs)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--aps", type=int, default=20000)
+    args = parser.parse_args()
+
+    raw = body(args.aps)
+    print(f"{args.aps} APs, {len(raw) / 1024 / 1024:.1f} MB body")
+    measure("json + APDBModel + AP (original)", model, raw)
+    measure("APDatabaseParser (validate)", lambda r: stream(r, validate=True), raw)
+    measure("APDatabaseParser (fast path)", stream, raw)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+#
+# Author: Wade Wells github/Pack3tL0ss
+"""End to end timing of the scripts against the local controller simulator.
+
+Runs image_versions.Controllers and the https-cert-sync discovery (login,
+show switches/vrrp, web-server profile + ServerCert per MD, no cert push)
+against benchmarks.simulator at each estate size.
+
+    python -m benchmarks.end_to_end [--mds 10 100 1000] [--latency 0.02] [--max-ms-per-md 50]
+
+The response and session caches are disabled and, unless --rate-limit is given,
+so are the login rate limits, the numbers are for the request path itself.
+Exits non-zero if --max-ms-per-md is given and any run exceeds it.
+"""
+import argparse
+import contextlib
+import importlib
+import io
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import common
+from benchmarks.simulator import ControllerSimulator
+from common import config, log
+from common.cache import CertCache
+
+image_versions = importlib.import_module("image_versions")
+cert_sync = importlib.import_module("https-cert-sync")
+
+
+def run_image_versions(sim: ControllerSimulator) -> int:
+    ctl = image_versions.Controllers(sim.conductors)
+    return len([dev for dev in ctl.data.values() if dev.version_0_0])
+
+
+def run_cert_sync_discovery(sim: ControllerSimulator) -> int:
+    # the new cert is normally loaded from the p12 in config, the discovery only needs one to exist
+    new_cert = cert_sync.Certificate({"cert_cn": "bench", "cert_exp_date": datetime.now(timezone.utc) + timedelta(days=90)})
+    ctl = cert_sync.Controllers(sim.conductors, new_cert=new_cert, run=False)
+    cert_sync.cert_cache = CertCache()  # fresh per run, MDs within the run still share it
+    ctl.start_controller_threads(ctl.conductors)
+    ctl.exec_api()
+    ctl.start_controller_threads([dev for dev in ctl.data if ctl.data[dev].connection is None])
+    return len(list(ctl.exec_api_md()))
+
+
+def timed(name: str, func, sim: ControllerSimulator, mds: int, max_ms: float = None) -> bool:
+    start_requests = sim.requests
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        found = func(sim)
+        log.flush()
+    elapsed = time.perf_counter() - start
+    per_md = elapsed / mds * 1000
+    ok = max_ms is None or per_md <= max_ms
+    print(
+        f"{name:<24} {mds:>5} MDs {elapsed:8.2f} s {per_md:8.2f} ms/MD "
+        f"{sim.requests - start_requests:>6} requests  {found:>5} complete{'' if ok else '  ** OVER BUDGET **'}"
+    )
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mds", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to each simulated request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of simulated requests that fail (0-1)")
+    parser.add_argument("--workers", type=int, default=config.workers)
+    parser.add_argument("--rate-limit", type=float, default=0, help="logins per second, 0 = unlimited")
+    parser.add_argument("--max-ms-per-md", type=float, help="fail if any run exceeds this many ms per MD")
+    args = parser.parse_args()
+
+    common.session_cache = common.response_cache = None
+    config.user, config.password = config.user or "admin", config.password or "admin"  # the simulator accepts any
+    config.workers = args.workers
+    config.rate_limit = config.controller_rate_limit = args.rate_limit
+
+    ok = True
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        config.cache_dir = Path(tmp)  # keep the snapshot etc. out of the real .cache
+        os.chdir(tmp)  # results.csv / results.txt
+        try:
+            for mds in args.mds:
+                with ControllerSimulator(mds, latency=args.latency, error_rate=args.error_rate, seed=0) as sim:
+                    ok &= timed("image_versions", run_image_versions, sim, mds, args.max_ms_per_md)
+                    ok &= timed("cert-sync discovery", run_cert_sync_discovery, sim, mds, args.max_ms_per_md)
+        finally:
+            os.chdir(cwd)
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
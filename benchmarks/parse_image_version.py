@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+#
+# Author: Wade Wells github/Pack3tL0ss
+"""Per-device cost of parsing show image version at estate scale.
+
+Compares common.parse.show_image_version against the original line by line
+implementation (kept here as legacy_show_image_version for reference).
+
+    python -m benchmarks.parse_image_version [--devices 10000] [--partitions 2]
+"""
+import argparse
+import time
+
+from common import parse
+
+PARTITION = """----------------------------------
+Partition               : 0:{idx} (/dev/usb/flash{num}){default}
+Software Version        : ArubaOS 8.{idx}.0.{num} (Digitally Signed SHA1/SHA256 - Production Build)
+Build number            : 7496{idx}
+Label                   : 7496{idx}
+Built on                : Thu Apr 16 15:34:44 UTC 2020"""
+
+
+def sample(partitions: int = 2) -> dict:
+    text = "\n".join(
+        PARTITION.format(idx=i, num=i + 1, default=" **Default boot**" if i == 0 else "") for i in range(partitions)
+    )
+    return {"_data": [text + "\n"], "_meta": []}
+
+
+def legacy_show_image_version(data):
+    data = data.get('_data', [])[0].split('\n')
+    img_dict = {}
+    _part = 'err'
+    for line in data:
+        if line.startswith("Partition"):
+            if '0:0' in line:
+                _part = '0:0'
+            elif '0:1' in line:
+                _part = '0:1'
+            if 'Default boot' in line:
+                img_dict['default_boot'] = f"0:{line.split(':')[2].replace(' **Default boot**', '')}"
+            continue
+        if line.startswith('Software Version'):
+            img_dict[f"version {_part}"] = line.split(':')[-1].replace('ArubaOS ', '').split('(')[0].strip()
+        if line.startswith('Build num'):
+            img_dict[f"version {_part}"] += f"_{line.split(':')[-1].strip()}"
+
+    return img_dict
+
+
+def bench(name: str, func, data: list, repeat: int = 5) -> float:
+    best = min(_timed(func, data) for _ in range(repeat))
+    print(f"{name:<34} {best * 1000:8.1f} ms total {best / len(data) * 1e6:8.2f} us/device")
+    return best
+
+
+def _timed(func, data: list) -> float:
+    start = time.perf_counter()
+    func(data)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, default=10000)
+    parser.add_argument("--partitions", type=int, default=2)
+    args = parser.parse_args()
+
+    data = [sample(args.partitions)] * args.devices
+    assert parse.show_image_version(data[0]).version("0:0") == legacy_show_image_version(data[0])["version 0:0"]
+
+    print(f"{args.devices} devices, {args.partitions} partitions each")
+    bench("legacy (line by line)", lambda d: [legacy_show_image_version(x) for x in d], data)
+    bench("show_image_version (per device)", lambda d: [parse.show_image_version(x) for x in d], data)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+#
+# Author: Wade Wells github/Pack3tL0ss
+"""Local stand-in for an ArubaOS 8 estate (Conductors + MDs) over HTTPS.
+
+One threaded HTTPS server answers for every device, each device is a loopback
+address (127.20.x.y, all of 127/8 is local on Linux) and the device a request
+is for is the local address it arrived on.  Implements /v1/api/login,
+/v1/api/logout and /v1/configuration/showcommand with synthetic output for
+show switches, show vrrp, show image version, show web-server profile,
+show crypto pki ServerCert and show ap database.
+
+    python -m benchmarks.simulator [--mds 100] [--latency 0.05] [--error-rate 0.01]
+
+then point config.yaml conductors at the address printed.
+"""
+from __future__ import annotations
+
+import argparse
+import datetime
+import ipaddress
+import json
+import random
+import ssl
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+BASE = ipaddress.IPv4Address("127.20.0.0")
+PARTITION = """----------------------------------
+Partition               : 0:{idx} (/dev/usb/flash{num}){default}
+Software Version        : ArubaOS 8.{minor}.0.{patch} (Digitally Signed SHA1/SHA256 - Production Build)
+Build number            : {build}
+Label                   : {build}
+Built on                : Thu Apr 16 15:34:44 UTC 2020"""
+
+
+def self_signed(directory: Path) -> Tuple[Path, Path]:
+    """Write a throw away cert/key pair to directory, returns (cert, key) paths."""
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "aos8-simulator")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+        .serial_number(x509.random_serial_number()).not_valid_before(now).not_valid_after(now + datetime.timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    cert_file, key_file = directory / "sim.crt", directory / "sim.key"
+    cert_file.write_bytes(cert.public_bytes(serialization.Encoding.PEM))
+    key_file.write_bytes(
+        key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+    )
+    return cert_file, key_file
+
+
+class Device:
+    __slots__ = ("ip", "name", "type", "version", "cert_name", "aps")
+
+    def __init__(self, ip: str, name: str, type: str, version: str, cert_name: str, aps: int = 0):
+        self.ip = ip
+        self.name = name
+        self.type = type
+        self.version = version
+        self.cert_name = cert_name
+        self.aps = aps
+
+    def switch_entry(self) -> dict:
+        return {
+            "Config ID": "1234", "Config Sync Time (sec)": "0", "Configuration State": "UPDATE SUCCESSFUL",
+            "IP Address": self.ip, "Location": "Building1.floor1", "Model": "Aruba7205", "Name": self.name,
+            "Status": "up", "Type": self.type, "Version": self.version,
+        }
+
+
+class ControllerSimulator:
+    def __init__(self, mds: int = 10, conductors: int = 1, *, latency: float = 0.0, error_rate: float = 0.0,
+                 aps_per_md: int = 50, host: str = "0.0.0.0", port: int = 4343, seed: int = None):
+        """Simulated estate, served from a background thread by start().
+
+        Args:
+            mds (int, optional): Number of Managed Devices. Defaults to 10.
+            conductors (int, optional): Number of Conductors, each reports every MD in show switches. Defaults to 1.
+            latency (float, optional): Seconds added to every request. Defaults to 0.0.
+            error_rate (float, optional): Fraction (0-1) of requests answered with a 500. Defaults to 0.0.
+            aps_per_md (int, optional): APs reported in show ap database by each MD. Defaults to 50.
+            host (str, optional): Address to bind. Defaults to "0.0.0.0" (needed to answer on every 127.20.x.y).
+            port (int, optional): Port to listen on, the scripts use 4343. Defaults to 4343.
+            seed (int, optional): Seed for error injection. Defaults to None.
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.host = host
+        self.port = port
+        self.random = random.Random(seed)
+        self.sessions: set = set()
+        self.requests = self.errors = 0
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+        self._tmp: Optional[tempfile.TemporaryDirectory] = None
+        self.devices: Dict[str, Device] = {}
+        for i in range(conductors):
+            ip = str(BASE + 1 + i)
+            self.devices[ip] = Device(ip, f"conductor{i + 1}", "conductor", "8.10.0.12_91022", "LE_Conductor", 0)
+        for i in range(mds):
+            ip = str(BASE + 256 + (i // 250) * 256 + i % 250 + 1)  # 127.20.1.1 ... skips .0 and .251-.255
+            self.devices[ip] = Device(ip, f"md{i + 1:05d}", "MD", "8.10.0.12_91022", f"LE_{i % 4}", aps_per_md)
+
+    @property
+    def conductors(self) -> List[str]:
+        return [ip for ip, dev in self.devices.items() if dev.type == "conductor"]
+
+    @property
+    def mds(self) -> List[str]:
+        return [ip for ip, dev in self.devices.items() if dev.type == "MD"]
+
+    def __enter__(self) -> "ControllerSimulator":
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    def start(self) -> "ControllerSimulator":
+        self._tmp = tempfile.TemporaryDirectory()
+        cert, key = self_signed(Path(self._tmp.name))
+        ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        ctx.load_cert_chain(cert, key)
+        handler = type("Handler", (SimulatorHandler,), {"sim": self})
+        self._server = ThreadingHTTPServer((self.host, self.port), handler)
+        self._server.daemon_threads = True
+        self._server.request_queue_size = 1024
+        # handshake on first read, in the request thread, rather than serialized in accept()
+        self._server.socket = ctx.wrap_socket(self._server.socket, server_side=True, do_handshake_on_connect=False)
+        self._thread = threading.Thread(target=self._server.serve_forever, name="aos8-sim", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self._tmp is not None:
+            self._tmp.cleanup()
+            self._tmp = None
+
+    def fail(self) -> bool:
+        """Count the request and decide (per error_rate) if it should fail."""
+        with self._lock:
+            self.requests += 1
+            if self.error_rate and self.random.random() < self.error_rate:
+                self.errors += 1
+                return True
+        return False
+
+    # -- synthetic show command output --
+    def show(self, dev: Device, cmd: str) -> dict:
+        if cmd == "show switches":
+            devices = self.devices.values() if dev.type == "conductor" else [dev]
+            return {"All Switches": [d.switch_entry() for d in devices], "_meta": ["Name"]}
+        if cmd == "show vrrp":
+            return {"_data": ["Virtual Router 10:\n    Admin State UP, VR State MASTER\n    IP Address 10.255.255.254"]}
+        if cmd == "show image version":
+            idx = int(ipaddress.IPv4Address(dev.ip)) % 2
+            parts = [
+                PARTITION.format(idx=i, num=i + 1, minor=10 - i, patch=12 - i, build=91022 - i,
+                                 default=" **Default boot**" if i == idx else "")
+                for i in range(2)
+            ]
+            return {"_data": ["\n".join(parts) + "\n"], "_meta": []}
+        if cmd == "show web-server profile":
+            return {"Web Server Configuration": [
+                {"Parameter": "Cipher Suite Strength", "Value": "high"},
+                {"Parameter": "Captive Portal Certificate", "Value": dev.cert_name},
+                {"Parameter": "Management user's WebUI access method", "Value": "username/password"},
+            ], "_meta": ["Parameter", "Value"]}
+        if cmd.startswith("show crypto pki ServerCert"):
+            return {"_data": [
+                "Certificate:", "Subject: CN=securelogin.example.com", "Issuer: C=US, O=Let's Encrypt, CN=R3",
+                "Not Before: Oct  1 00:00:00 2026 GMT", "Not After : Dec 30 23:59:59 2026 GMT",
+                "            Authority Information Access:", "                CA Issuers - URI:http://r3.i.lencr.org/",
+                "            X509v3 Subject Alternative Name:", "                DNS:securelogin.example.com",
+            ]}
+        if cmd.startswith("show ap database"):
+            # 10.<device>.<ap>, the device from the low 16 bits of its (127.20.x.y) address
+            base = int(ipaddress.IPv4Address("10.0.0.0")) | (int(ipaddress.IPv4Address(dev.ip)) & 0xFFFF) << 8
+            return {"AP Database": [
+                {"AP Type": "AP-535", "Flags": "2", "Group": f"group-{i % 8}", "IP Address": str(ipaddress.IPv4Address(base + i % 256)),
+                 "Name": f"{dev.name}-ap{i:04d}", "Standby IP": "0.0.0.0",
+                 "Status": "Down" if i % 10 == 0 else "Up 3d:4h:12m:2s", "Switch IP": dev.ip}
+                for i in range(dev.aps)
+            ], "_data": [], "_meta": ["Flags"]}
+        return {"_data": [f"% Invalid input detected at '^' marker. ({cmd})"]}
+
+
+class SimulatorHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, the clients reuse connections
+    disable_nagle_algorithm = True  # headers and body are separate writes, avoids the delayed ACK stall
+    sim: ControllerSimulator
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, data: dict = None, cookie: str = None) -> None:
+        body = json.dumps(data or {}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if cookie:
+            self.send_header("Set-Cookie", f"SESSION={cookie}; Path=/; Secure; HttpOnly")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _device(self) -> Optional[Device]:
+        return self.sim.devices.get(self.connection.getsockname()[0])
+
+    def _begin(self) -> Optional[Device]:
+        """Common request handling, returns the device or None if a response was already sent."""
+        if self.sim.latency:
+            time.sleep(self.sim.latency)
+        dev = self._device()
+        if dev is None:
+            self._send(404, {"_global_result": {"status": "1", "status_str": "No such device"}})
+        elif self.sim.fail():
+            self._send(500, {"_global_result": {"status": "1", "status_str": "Simulated failure"}})
+        else:
+            return dev
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        form = parse_qs(self.rfile.read(length).decode())
+        if urlsplit(self.path).path != "/v1/api/login":
+            return self._send(404)
+        if self._begin() is None:
+            return
+        if not form.get("username"):
+            return self._send(401, {"_global_result": {"status": "1", "status_str": "Authentication failed"}})
+        uid = str(uuid.uuid4())
+        with self.sim._lock:
+            self.sim.sessions.add(uid)
+        self._send(200, {"_global_result": {"status": "0", "status_str": "You've logged in successfully.", "UIDARUBA": uid}},
+                   cookie=uid)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        dev = self._begin()
+        if dev is None:
+            return
+        if url.path == "/v1/api/logout":
+            uid = (query.get("UIDARUBA") or [None])[0]
+            with self.sim._lock:
+                self.sim.sessions.discard(uid)
+            return self._send(200, {"_global_result": {"status": "0", "status_str": "You've logged out successfully."}})
+        if url.path != "/v1/configuration/showcommand":
+            return self._send(404)
+        uid = (query.get("UIDARUBA") or [None])[0]
+        if uid not in self.sim.sessions:
+            return self._send(401, {"_global_result": {"status": "1", "status_str": "Session expired"}})
+        self._send(200, self.sim.show(dev, (query.get("command") or [""])[0]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mds", type=int, default=100)
+    parser.add_argument("--conductors", type=int, default=1)
+    parser.add_argument("--aps-per-md", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to each request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests that fail (0-1)")
+    parser.add_argument("--port", type=int, default=4343)
+    args = parser.parse_args()
+
+    sim = ControllerSimulator(args.mds, args.conductors, latency=args.latency, error_rate=args.error_rate,
+                              aps_per_md=args.aps_per_md, port=args.port)
+    with sim:
+        print(f"Simulating {len(sim.conductors)} conductor(s) {', '.join(sim.conductors)} with {args.mds} MDs on port {args.port}")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            print(f"{sim.requests} requests, {sim.errors} simulated errors")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+#
+# Author: Wade Wells github/Pack3tL0ss
+"""Import (startup) time of common and the entry scripts, checked against a budget.
+
+Each module is imported in a fresh interpreter with -X importtime, the import
+time attributed to it is the cumulative time of everything imported at the top
+level beyond what a bare interpreter already imports (site etc).  Best of
+--repeat runs.  Exits non-zero if any module is over budget.
+
+    python -m benchmarks.startup [--repeat 5] [--top 5] [--scale 1.0]
+"""
+import argparse
+import subprocess
+import sys
+from pathlib import Path
+from typing import List, Tuple
+
+REPO = Path(__file__).resolve().parent.parent
+
+# module -> budget in ms (cumulative import time)
+BUDGETS = {
+    "common": 60,
+    "apreboot": 150,
+    "ap_inventory": 120,
+    "image_versions": 100,
+    "https-cert-sync": 100,
+}
+
+
+def importtime(stmt: str) -> List[Tuple[int, int, str]]:
+    """Run stmt with -X importtime, returns [(cumulative us, depth, module)] for every import."""
+    res = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", stmt], cwd=REPO, capture_output=True, text=True, check=True
+    )
+    out = []
+    for line in res.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        out.append((int(cumulative), depth, name.strip()))
+    return out
+
+
+def measure(module: str, baseline: set) -> Tuple[float, List[Tuple[int, str]]]:
+    """ms attributed to importing module, and its top level imports (heaviest first)."""
+    rows = [(us, name) for us, depth, name in importtime(f"import importlib; importlib.import_module({module!r})")
+            if depth == 0 and name not in baseline]
+    return sum(us for us, _ in rows) / 1000, sorted(rows, reverse=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("modules", nargs="*", default=list(BUDGETS))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=5, help="show the heaviest N top level imports")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply budgets (slow machines)")
+    args = parser.parse_args()
+
+    baseline = {name for _, depth, name in importtime("import importlib") if depth == 0}
+    ok = True
+    for module in args.modules:
+        runs = [measure(module, baseline) for _ in range(args.repeat)]
+        ms, rows = min(runs, key=lambda r: r[0])
+        budget = BUDGETS.get(module, 0) * args.scale
+        over = budget and ms > budget
+        ok &= not over
+        print(f"{module:<18} {ms:8.1f} ms  budget {budget:6.0f} ms{'  ** OVER BUDGET **' if over else ''}")
+        for us, name in rows[:args.top]:
+            print(f"    {us / 1000:8.1f} ms  {name}")
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,31 @@
 # -*- coding: utf-8 -*-
+"""Shared API client, logging and config.
 
+Kept cheap to import: requests/urllib3 load on the first sync API call, and
+config.yaml is read (and logging/caches/resolver set up) the first time config,
+log, session_cache, response_cache, cert_cache or resolver is used.
+"""
+from __future__ import annotations
+
+import atexit
+import json
 import logging
-from typing import Union
-import urllib3
-import requests
-from .config import Config
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+import threading
+from typing import TYPE_CHECKING, Optional, Union
+from .cache import CertCache, ResponseCache, SessionCache
+from .metrics import Metrics
+from .resolver import Resolver
 from sys import argv
 # from pathlib import Path
 from pathlib import PurePath
 
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+if TYPE_CHECKING:
+    import requests
+
+    from .config import Config
 
 headers = {
     "Content-Type": "application/json",
@@ -17,6 +33,14 @@ headers = {
 }
 
 
+def _requests():
+    """Import requests on first use (and silence the self-signed cert warnings from urllib3)."""
+    import requests
+    import urllib3
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+    return requests
+
+
 class Response():
     def __init__(self, ok: bool, output=None, error=None, status_code=None, state=None, **kwargs):
         self.ok = ok
@@ -35,17 +59,48 @@ class Response():
 
 class AosConnect(Response):
 
-    def __init__(self, ip: str, user: str = '', password: str = '', port: int = 4343):
+    def __init__(self, ip: str, user: str = '', password: str = '', port: int = 4343,
+                 use_session_cache: bool = True, use_response_cache: bool = True, timeout: float = None):
         self.ip = ip
         self.port = port
         self.user = user
         self.password = password
         self.handle = None
+        self.uid = None
         self.output = ''
+        _init()
+        self.timeout = timeout or config.api_timeout
+        self.session_cache = session_cache if use_session_cache else None
+        self.response_cache = response_cache if use_response_cache else None
+        self._cache_key = SessionCache.key(ip, user, port)
+        self._login_lock = threading.Lock()  # commands may share the connection across threads (see pipeline)
+        self._login_deferred = False
+
+    def _new_handle(self, uid: str) -> requests.Session:
+        handle = _requests().Session()
+        handle.verify = False
+        handle.headers.update(headers)
+        handle.cookies.set("SESSION", uid)
+        return handle
+
+    @property
+    def logged_in(self) -> bool:
+        """True once logged in, or if the login is deferred to the first response cache miss."""
+        return self.handle is not None or self._login_deferred
+
+    def close(self) -> None:
+        """Close the session (a deferred login that was never needed is just dropped)."""
+        self._login_deferred = False
+        if self.handle is not None:
+            self.handle.close()
 
-    def api_login(self) -> object:
+    def api_login(self, use_cache: bool = True, lazy: bool = False) -> object:
         """
         This function will login into the controller using API.
+        A cached session is used if the session cache is enabled and has a valid entry,
+        it is validated by the first command ran (see execute_command).
+        With lazy and the response cache enabled the login is deferred until a command
+        misses the cache, a run answered from the cache never logs in.
         :return: connection handle for the device.
         """
 
@@ -53,29 +108,82 @@ class AosConnect(Response):
         payload = {'username': self.user, 'password': self.password}
 
         if self.ip:
+            if lazy and self.response_cache:
+                self._login_deferred = True
+                return Response(ok=True, output="login deferred until first response cache miss")
+            if use_cache and self.session_cache:
+                uid = self.session_cache.get(self._cache_key)
+                if uid:
+                    self.uid = uid
+                    self.handle = self._new_handle(uid)
+                    return Response(ok=True, output="cached session", json={"_global_result": {"UIDARUBA": uid}})
             try:
-                r = requests.post(url, data=payload, headers=headers, verify=False)
-                self.handle = r
+                with metrics.timer("api_login", self.ip) as call:
+                    r = _requests().post(url, data=payload, headers=headers, verify=False, timeout=self.timeout)
+                    call.ok, call.bytes = r.ok, len(r.content)
+                if not r.ok:
+                    return Response(ok=False, output=r.text, error=r.reason, status_code=r.status_code)
+                uid = r.cookies.get("SESSION") or r.json().get("_global_result", {}).get("UIDARUBA")
+                if not uid:
+                    return Response(ok=False, output=r.text, error="No session (UIDARUBA) cookie in login response", status_code=r.status_code)
+                self.uid = uid
+                self.handle = self._new_handle(self.uid)
+                # only a successful login is cached
+                if self.session_cache:
+                    self.session_cache.set(self._cache_key, self.uid)
                 return Response(ok=True, output=r.text, json=r.json(), status_code=r.status_code)
             except Exception as err:
                 return Response(ok=False, error=err)
         else:
             return Response(ok=False, error="No IP address")
 
-    def execute_command(self, cmd: str) -> object:
+    def _relogin(self, stale_uid: str) -> Response:
+        """Login again after a 401 on stale_uid, once, however many threads saw the 401."""
+        with self._login_lock:
+            if self.uid != stale_uid:  # another thread already logged in again
+                return Response(ok=True, output="session renewed")
+            log.info(f"{self.ip}: API session expired, logging in again")
+            if self.session_cache:
+                self.session_cache.invalidate(self._cache_key)
+            self.handle.close()
+            return self.api_login(use_cache=False)
+
+    def execute_command(self, cmd: str, use_cache: bool = True, _retry: bool = True) -> object:
         """
         This function will execute commands on controller and returns the output
+        If the session has expired (401) a new login is performed and the command retried once.
         :param cmd: command to be executed on device
+        :param use_cache: Set False to bypass the response cache (the fresh result is still cached)
         :return: data containing output of the command
         """
+        if use_cache and self.response_cache:
+            cached = self.response_cache.get(self.ip, cmd)
+            if cached:
+                status_code, text = cached
+                return Response(ok=True, output=text, status_code=status_code, json=json.loads(text))
+        if self.handle is None and self._login_deferred:
+            with self._login_lock:
+                if self.handle is None:
+                    login = self.api_login()
+                    if not login.ok:
+                        return login
         try:
-            parameters = {"UIDARUBA": self.handle.headers['Set-Cookie'].split(';')[0].split('=')[1], "command": cmd}
-            r = requests.get(f"https://{self.ip}:{self.port}/v1/configuration/showcommand",
-                             verify=False,
-                             headers=headers,
-                             params=parameters, cookies=self.handle.cookies
-                             )
+            uid, handle = self.uid, self.handle
+            parameters = {"UIDARUBA": uid, "command": cmd}
+            with metrics.timer("execute_command", self.ip, cmd) as call:
+                r = handle.get(f"https://{self.ip}:{self.port}/v1/configuration/showcommand", params=parameters, verify=False, timeout=self.timeout)
+                call.ok, call.bytes = r.ok, len(r.content)
+                call.retries = int(r.status_code == 401 and _retry)
+            if r.status_code == 401 and _retry:
+                login = self._relogin(uid)
+                if not login.ok:
+                    return login
+                return self.execute_command(cmd, use_cache=False, _retry=False)
             if r.ok:
+                if self.session_cache:
+                    self.session_cache.touch(self._cache_key)
+                if self.response_cache:
+                    self.response_cache.set(self.ip, cmd, r.status_code, r.text)
                 return Response(ok=True, output=r.text, status_code=r.status_code, json=r.json())
             else:
                 return Response(ok=False, error=r.reason, status_code=r.status_code)
@@ -83,46 +191,99 @@ class AosConnect(Response):
             return Response(ok=False, error=err)
 
 
+class _JsonFormatter(logging.Formatter):
+    """One json object per line."""
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps({
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "pid": record.process,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        })
+
+
+class _StdoutHandler(logging.StreamHandler):
+    """Writes to whatever sys.stdout is at the time (as print does), so redirect_stdout etc. still apply."""
+    def __init__(self):
+        super().__init__(sys.stdout)
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
 class MyLogger:
-    def __init__(self, log_file: Union[str, PurePath], debug: bool = False, show: bool = False):
-        self.log_msgs = []
+    _listener: Optional[QueueListener] = None  # one listener (and set of file handlers) per process
+
+    def __init__(self, log_file: Union[str, PurePath], debug: bool = False, show: bool = False, json_file: Union[str, PurePath] = None):
+        """Logging is handed off to a queue, a single listener thread does the file writes (and console output)
+        so calling threads never block on log I/O.
+
+        Args:
+            log_file (Union[str, PurePath]): Log file.
+            debug (bool, optional): Log debug messages. Defaults to False.
+            show (bool, optional): Default for show (print to console) on info and above. Defaults to False.
+            json_file (Union[str, PurePath], optional): Also write each message as a json line to this file. Defaults to None.
+        """
         self.DEBUG = debug
         self.verbose = False
-        if isinstance(log_file, PurePath):
-            self.log_file = log_file
-        else:
-            self.log_file = PurePath(log_file)
+        self.log_file = log_file if isinstance(log_file, PurePath) else PurePath(log_file)
+        self.json_file = None if not json_file else PurePath(json_file)
         self._log = self.get_logger()
         self.name = self._log.name
         self.show = show  # Sets default log behavior (other than debug)
 
     def get_logger(self):
-        '''Return custom log object.'''
-        fmtStr = "%(asctime)s [%(process)d][%(levelname)s]: %(message)s"
-        dateStr = "%m/%d/%Y %I:%M:%S %p"
-        logging.basicConfig(filename=self.log_file,
-                            level=logging.DEBUG if self.DEBUG else logging.INFO,
-                            format=fmtStr,
-                            datefmt=dateStr)
+        '''Return custom log object.
+
+        Handlers are attached to the root logger (so library logging lands in the log file too) the first
+        time a MyLogger is created, subsequent instances share them.
+        '''
+        if MyLogger._listener is None:
+            fmtStr = "%(asctime)s [%(process)d][%(levelname)s]: %(message)s"
+            dateStr = "%m/%d/%Y %I:%M:%S %p"
+            file_handler = logging.FileHandler(self.log_file)
+            file_handler.setFormatter(logging.Formatter(fmtStr, datefmt=dateStr))
+            file_handler.addFilter(lambda record: getattr(record, "log", True))
+            console = _StdoutHandler()
+            console.setFormatter(logging.Formatter("%(message)s"))
+            console.addFilter(lambda record: getattr(record, "show", False))
+            handlers = [file_handler, console]
+            if self.json_file:
+                json_handler = logging.FileHandler(self.json_file)
+                json_handler.setFormatter(_JsonFormatter())
+                json_handler.addFilter(lambda record: getattr(record, "log", True))
+                handlers.append(json_handler)
+
+            root = logging.getLogger()
+            root.addHandler(QueueHandler(queue.Queue()))
+            root.setLevel(logging.DEBUG if self.DEBUG else logging.INFO)
+            MyLogger._listener = QueueListener(root.handlers[-1].queue, *handlers, respect_handler_level=True)
+            MyLogger._listener.start()
+            atexit.register(MyLogger._listener.stop)  # drains the queue
         return logging.getLogger(self.log_file.stem)
 
+    def flush(self) -> None:
+        """Block until everything logged so far has been written/printed."""
+        if MyLogger._listener is not None:
+            MyLogger._listener.queue.join()
+
     def log_print(self, msgs, log=False, show=True, level='info', *args, **kwargs):
         msgs = [msgs] if not isinstance(msgs, list) else msgs
-        _msgs = []
-        _logged = []
-        for i in msgs:
-            i = str(i)
-            if log and i not in _logged:
-                getattr(self._log, level)(i)
-                _logged.append(i)
-                if i and i not in self.log_msgs:
-                    _msgs.append(i)
-
-        if show:
-            self.log_msgs += _msgs
-            for m in self.log_msgs:
-                print(m)
-            self.log_msgs = []
+        if not (log or show):
+            return
+        # dict keeps order and de-duplicates in one pass
+        for i in dict.fromkeys(map(str, msgs)):
+            if not log and i == "":
+                continue
+            self._log.log(logging.getLevelName(level.upper()) if level != "exception" else logging.ERROR, i,
+                          exc_info=level == "exception", extra={"log": log, "show": bool(show) and i != ""})
 
     def show(self, msgs: Union[list, str], log: bool = False, show: bool = True, *args, **kwargs) -> None:
         self.log_print(msgs, show=show, log=log, *args, **kwargs)
@@ -166,5 +327,48 @@ class MyLogger:
 _calling_script = PurePath(argv[0])
 log_file = PurePath.joinpath(_calling_script.parent, "logs", f"{_calling_script.stem}.log")
 
-config = Config()
-log = MyLogger(log_file, debug=config.DEBUG, show=True)
+metrics = Metrics()
+_init_lock = threading.Lock()
+_LAZY = ("config", "log", "session_cache", "response_cache", "cert_cache", "resolver")
+
+
+def _init() -> None:
+    """Read config.yaml and create log, the caches and the resolver, once."""
+    global config, log, session_cache, response_cache, cert_cache, resolver
+    if "response_cache" in globals():
+        return
+    with _init_lock:
+        if "response_cache" in globals():
+            return
+        # imported here, not at the top: importing .config binds the submodule to the name config,
+        # until then there is no such attribute and __getattr__ gets to create the Config instance
+        from .config import Config
+
+        config = Config()
+        log = MyLogger(log_file, debug=config.DEBUG, show=True, json_file=None if not config.log_json else log_file.with_suffix(".jsonl"))
+        session_cache = None if not config.session_cache else SessionCache(config.cache_dir / "sessions.json", ttl=config.session_cache_ttl)
+        cert_cache = CertCache(
+            None if not config.cert_cache_persist else config.cache_dir / "certs.json",
+            refresh_before=config.cert_cache_refresh_days * 86400,
+        )
+        resolver = Resolver(
+            config.dns_cache_ttl,
+            path=None if not config.dns_cache_persist else config.cache_dir / "dns.json",
+            workers=config.workers,
+            timeout=config.dns_timeout,
+        )
+        if config.metrics:
+            atexit.register(metrics.export, (config.metrics_dir or log_file.parent) / _calling_script.stem)
+        # assigned last, its presence marks init complete
+        response_cache = None if not config.response_cache else ResponseCache(
+            config.response_cache_ttl,
+            maxsize=config.response_cache_size,
+            path=None if not config.response_cache_persist else config.cache_dir / "responses.json"
+        )
+
+
+def __getattr__(name: str):
+    if name in _LAZY:
+        _init()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
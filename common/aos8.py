@@ -19,38 +19,55 @@ except ImportError:
     print("Error importing Paramiko module, please install it with \"pip install paramiko\". Quitting...")
     exit(-1)
 
-import time
+import codecs
 import re
 import socket
 
 
+# AOS 8 CLI prompts i.e. "(host) [mynode] #", "(host) *[mynode] (config) #" or "(host) #"
+PROMPT_RE = re.compile(
+    r'^\([a-zA-Z0-9\-\_]*\) (?:[\^\*]{0,2}\[[a-zA-Z0-9\-\_]*\] [\^\*]{0,2}\(?[a-zA-Z0-9\-\_]*\)?|[\^\*]{0,2})\s?#',
+    re.MULTILINE
+)
+
+
 # Check if string contains AOS 8 prompt -> Implies target is ready to accept next command, or end of output.
 def is_contain_prompt(input_str: str = "") -> bool:
-    input_str = input_str.replace('\r', '')
+    return PROMPT_RE.search(input_str.replace('\r', '')) is not None
 
-    if re.search('^\([a-zA-Z0-9\-\_]*\) [\^\*]{0,2}\[[a-zA-Z0-9\-\_]*\] [\^\*]{0,2}\(?[a-zA-Z0-9\-\_]*\)?\s?#', input_str, re.MULTILINE):
-        return True
-    elif re.search('^\([a-zA-Z0-9\-\_]*\) [\^\*]{0,2}\s?#', input_str, re.MULTILINE):
-        return True
-    else:
-        return False
 
+class PromptScanner:
+    """Accumulates shell output and detects the CLI prompt in linear time.
 
-# Remove the executed command and CLI prompt from output
-def clean_output(output: str, command: str = ""):
-    output = output.replace('\r', '')
-    lines = output.splitlines(True)
-    clean_output = []
+    The prompt is always at the start of a line, so each chunk is only scanned together with the
+    partial line carried over from the previous chunk, never the whole buffer.
+    """
+    def __init__(self):
+        self.chunks = []
+        self._partial = ""
+        self.found = False
+
+    def feed(self, chunk: str) -> bool:
+        """Add chunk, returns True once the prompt has been seen."""
+        chunk = chunk.replace('\r', '')
+        self.chunks.append(chunk)
+        pending = self._partial + chunk
+        if PROMPT_RE.search(pending):
+            self.found = True
+        self._partial = pending[pending.rfind('\n') + 1:]
+        return self.found
 
-    for line in lines:
-        if is_contain_prompt(line):
-            pass
-        elif command != "" and re.search(command, line, re.MULTILINE):
-            pass
-        else:
-            clean_output.append(line.rstrip())
+    @property
+    def data(self) -> str:
+        return "".join(self.chunks)
 
-    return "\n".join(clean_output)
+
+# Remove the executed command and CLI prompt from output
+def clean_output(output: str, command: str = ""):
+    return "\n".join([
+        line.rstrip() for line in output.replace('\r', '').splitlines()
+        if not PROMPT_RE.match(line) and (not command or command not in line)
+    ])
 
 
 class AOS8SSHClient(paramiko.SSHClient):
@@ -68,6 +85,8 @@ class AOS8SSHClient(paramiko.SSHClient):
 
     def aos8invoke_shell(self):
         self.shell = self.invoke_shell()
+        # Drain the banner and initial prompt, otherwise it's taken as the end of the first command's output
+        self._read_until_prompt()
         self.aos8execute("no paging")
 
     def aos8close(self):
@@ -76,25 +95,28 @@ class AOS8SSHClient(paramiko.SSHClient):
             self.shell = None
         self.close()
 
-    def aos8execute(self, command):
-        if self.shell is not None:
-            self.shell.sendall(command + "\n")  # TODO Add except handling; otherwise current uncaught exception
-            time.sleep(0.5)  # allow target to react
+    def _read_until_prompt(self) -> str:
+        """Read from the shell until the CLI prompt, a timeout or the channel closing."""
+        scanner = PromptScanner()
+        decoder = codecs.getincrementaldecoder('utf-8')('ignore')
 
-            data = ""
-            buffer = ""
+        while True:
+            try:
+                buffer = self.shell.recv(65535)
+            except socket.timeout:
+                break
+            if not buffer:  # channel closed
+                break
 
-            while True:
-                try:
-                    buffer = self.shell.recv(65535)
-                except socket.timeout:
-                    break
+            # Check for CLI prompt; means command is completed so we don't have to wait for a timeout.
+            if scanner.feed(decoder.decode(buffer)):
+                break
 
-                data += buffer.decode()
+        return scanner.data
 
-                # Check for CLI prompt; means command is completed so we don't have to wait for a timeout.
-                if is_contain_prompt(data):
-                    break
+    def aos8execute(self, command):
+        if self.shell is not None:
+            self.shell.sendall(command + "\n")  # TODO Add except handling; otherwise current uncaught exception
 
             # Cleanup before returning data.
-            return clean_output(data, command)
+            return clean_output(self._read_until_prompt(), command)
@@ -2,9 +2,35 @@ import os
 import paramiko
 import time
 import re
+import select
 import socket
 import typer
-from . import log
+from typing import Pattern, Tuple
+from . import log, metrics
+
+PROMPT_END = re.compile('#')
+PROMPT_SEARCH_TAIL = 256
+PROMPT_HOST = re.compile(r'^\(([^)]*)\)')
+
+
+def prompt_pattern(prompt: str, end: str = '#') -> Pattern:
+    """Regex for the CLI prompt of the host in prompt (as captured at login), whatever node/mode it's in.
+
+    The node and mode change as commands run, "(host) [mynode] #" becomes i.e.
+    "(host) ^[md/site] (Web Server Configuration) #" after a cd and a config change,
+    so only the host is anchored.
+
+    Args:
+        prompt (str): Prompt at login, spaces removed i.e. "(host)[mynode]#".
+        end (str, optional): Characters that may end the prompt. Defaults to '#'.
+    """
+    m = PROMPT_HOST.match(prompt)
+    if not m:  # not an AOS8 style prompt, anything ending the way the login prompt did
+        return re.compile(re.escape(prompt.rstrip(end)) + f'.*[{re.escape(end)}]')
+    return re.compile(
+        rf'^\({re.escape(m.group(1))}\) ?(?:[\^\*]{{0,2}}\[[^\]\n]*\] ?)?[\^\*]{{0,2}}(?:\([^)\n]*\) ?)?[{re.escape(end)}]',
+        re.MULTILINE
+    )
 # def log(msg):
 #     print(msg)
 
@@ -16,11 +42,14 @@ class Cli:
     https://github.com/aruba/aruba-switch-ansible
     """
     def __init__(self, ip: str = None, cli_user: str = None, cli_pass: str = None,
-                 cli_timeout: int = 5, cmd_list: list = None, **kwargs):
+                 cli_timeout: int = 5, cmd_list: list = None, cmd_timeout: int = 90, **kwargs):
 
         self.fail_msg = ''
+        self.ok = False  # True only once connected and the whole cmd_list ran without error
+        self.cli_output: list = []
         self.ip = ip
         self.cmd_list = cmd_list
+        self.cmd_timeout = cmd_timeout  # max seconds to wait for the prompt to return after each command
         if not cli_user or cli_pass is None or not cmd_list:
             log.info(f"No CLI Operations Performed on {ip} Missing/incomplete cli configuration")
         else:
@@ -37,16 +66,18 @@ class Cli:
     def fail_json(self, **kwargs):
         self.fail_msg = {k: v for k, v in kwargs.items()}
 
+    def output(self, command: str) -> str:
+        """Output of command from the last run, None if it wasn't run."""
+        _cmds = [c for c in self.cmd_list or [] if 'SLEEP' not in c]
+        return dict(zip(_cmds, self.cli_output)).get(command)
+
     def execute_command(self, command_list: list):
         """
         Execute command and returns output
         :param command_list: list of commands
         :return: output of show command
         """
-        if command_list.count("edomtset") >= 2:
-            prompt = re.compile(re.escape(self.prompt.replace('#', '').replace(')[', ') [')) + '.*[#\$]')
-        else:
-            prompt = re.compile(re.escape(self.prompt.replace('#', '').replace(')[', ') [')) + '.*#')
+        prompt = prompt_pattern(self.prompt, end='#$' if command_list.count("edomtset") >= 2 else '#')
 
         # Clear Buffer
         self.out_channel()
@@ -60,19 +91,11 @@ class Cli:
             if command.startswith('SLEEP'):
                 _ = os.system(command.lower())
             else:
-                self.in_channel(command)
-                count = 0
-                text = ''
-                fail = True
-                while count < 45:
-                    time.sleep(2)
-                    curr_text = self.out_channel(command)
-                    text += curr_text
-                    if prompt.search(curr_text):
-                        fail = False
-                        break
-                    count += 1
-                if fail:
+                with metrics.timer("cli", self.ip, command) as call:
+                    self.in_channel(command)
+                    text, ok = self.read_until(prompt, command)
+                    call.ok, call.bytes = ok, len(text)
+                if not ok:
                     self.fail_json(msg='Unable to read CLI Output in given Time')
                 # Reformat text
                 text = text.replace('\r', '').rstrip('\n')
@@ -88,57 +111,80 @@ class Cli:
         Additional needed Setup for Connection
         """
         # Set prompt
-        count = 0
-        fail = True
         self.in_channel("")
-        while count < 45:
-            time.sleep(2)
-            curr_text = self.out_channel()
-            if '#' in curr_text:
-                fail = False
-                break
-            count += 1
-        if fail:
+        _, ok = self.read_until(PROMPT_END)
+        if not ok:
             self.fail_json(msg='Unable to read CLI Output in given Time')
 
         # Set prompt
-        count = 0
         self.in_channel("")
         # Regex for ANSI escape chars and prompt
-        text = ''
-        fail = True
-        while count < 45:
-            time.sleep(2)
-            curr_text = self.out_channel()
-            text += curr_text.replace('\r', '')
-            if '#' in curr_text:
-                fail = False
-                break
-            count += 1
-
-        if fail:
+        text, ok = self.read_until(PROMPT_END)
+        text = text.replace('\r', '')
+        if not ok:
             self.fail_json(msg='Unable to read CLI Output in given Time for prompt')
 
         # typer.unstyle removes all ANSI escape chars
         self.prompt = typer.unstyle(text).strip('\n').replace(' ', '')
 
+    def read_until(self, pattern: Pattern, command: str = "", timeout: float = None) -> Tuple[str, bool]:
+        """Read from the shell until pattern is found in the output or the deadline passes.
+
+        Waits on the channel (select) rather than polling, so returns as soon as the prompt arrives.
+
+        Args:
+            pattern (Pattern): compiled regex indicating the output is complete (the prompt).
+            command (str, optional): command sent, its echo is stripped from the output. Defaults to "".
+            timeout (float, optional): Overall deadline in seconds. Defaults to cmd_timeout.
+
+        Returns:
+            Tuple[str, bool]: The output read, and True if pattern was found before the deadline.
+        """
+        deadline = time.monotonic() + (timeout or self.cmd_timeout)
+        chunks = []
+        tail = ''
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return self.normalize("".join(chunks), command), False
+            if not self.shell_chanel.recv_ready():
+                if self.shell_chanel.closed or self.shell_chanel.eof_received:
+                    self.fail_json(msg='Chanel gives no data. Chanel is closed by Switch.')
+                    return self.normalize("".join(chunks), command), False
+                select.select([self.shell_chanel], [], [], remaining)
+            curr_text = self.recv_all()
+            if curr_text:
+                chunks.append(curr_text)
+                # only the tail needs to be checked, the prompt could be split across reads
+                tail = typer.unstyle(tail + curr_text).replace('\r', '')[-PROMPT_SEARCH_TAIL:]
+                if pattern.search(tail):
+                    return self.normalize("".join(chunks), command), True
+
     def out_channel(self, command: str = ""):
         """
         Clear Buffer/Read from Shell
         :return: Read lines
         """
-        recv = ""
+        return self.normalize(self.recv_all(), command)
+
+    def recv_all(self) -> str:
+        """Read everything currently available on the shell (no normalization)."""
+        recv = []
         # Loop while shell is able to recv data
         while self.shell_chanel.recv_ready():
-            recv = self.shell_chanel.recv(65535)
-            if not recv:
+            chunk = self.shell_chanel.recv(65535)
+            if not chunk:
                 self.fail_json(msg='Chanel gives no data. Chanel is closed by Switch.')
-            recv = recv.decode('utf-8', 'ignore')
-            # remove all ANSI escape characters
-            recv = typer.unstyle(recv)
-            # normalize output (make all line endings consistent with \n and strip echo of provided cmd)
-            recv = "\n".join([line.rstrip() if not command or not line.startswith(command) else line[len(command):].rstrip() for line in recv.splitlines()])
-        return recv
+                break
+            recv.append(chunk)
+        return b"".join(recv).decode('utf-8', 'ignore')
+
+    @staticmethod
+    def normalize(recv: str, command: str = "") -> str:
+        # remove all ANSI escape characters
+        recv = typer.unstyle(recv)
+        # normalize output (make all line endings consistent with \n and strip echo of provided cmd)
+        return "\n".join([line.rstrip() if not command or not line.startswith(command) else line[len(command):].rstrip() for line in recv.splitlines()])
 
     def in_channel(self, cmd):
         """
@@ -176,7 +222,8 @@ class Cli:
             try:
                 go = False
                 # Connect to Switch via SSH
-                self.ssh_client.connect(**connection_args)
+                with metrics.timer("cli_connect", self.ip):
+                    self.ssh_client.connect(**connection_args)
                 self.prompt = ''
                 # SSH Command execution not allowed, therefore using the following paramiko functionality
                 self.shell_chanel = self.ssh_client.invoke_shell()
@@ -193,16 +240,19 @@ class Cli:
                 log.error('ZTP CLI Operations Failed, CLI Authentication Failed verify creds in config')
 
             if time.time() - _start_time >= 30:
+                self.fail_json(msg=f'Unable to establish CLI session with {self.ip}')
                 break  # Give Up
             else:
                 time.sleep(10)
 
         if go:
             try:
-                result['cli_output'] = self.execute_command(self.cmd_list)
+                result['cli_output'] = self.cli_output = self.execute_command(self.cmd_list)
                 result['changed'] = True
                 if self.fail_msg:
                     result['message'] += self.fail_msg.get('msg')
+                else:
+                    self.ok = True
             finally:
                 self.logout()
 
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+#
+# Author: Wade Wells github/Pack3tL0ss
+"""asyncio client for the ArubaOS 8 REST API.
+
+Same call pattern and Response objects as common.AosConnect, but each controller
+gets a single keep-alive aiohttp session so repeated show commands reuse the
+TLS connection instead of doing a handshake per call.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Tuple
+
+import aiohttp
+from yarl import URL
+
+from . import Response, headers, log, metrics, response_cache, session_cache
+from .cache import ResponseCache, SessionCache
+
+
+class AsyncAosConnect:
+    def __init__(self, ip: str, user: str = '', password: str = '', port: int = 4343, *,
+                 limit_per_host: int = 4, timeout: float = 30, connector: aiohttp.BaseConnector = None,
+                 use_session_cache: bool = True, use_response_cache: bool = True):
+        """Async API session with a single controller.
+
+        Args:
+            ip (str): ip or fqdn of the controller.
+            user (str, optional): API username. Defaults to ''.
+            password (str, optional): API password. Defaults to ''.
+            port (int, optional): API port. Defaults to 4343.
+            limit_per_host (int, optional): Max simultaneous connections to this controller.
+                Ignored if connector is provided. Defaults to 4.
+            timeout (float, optional): Total timeout (seconds) for each request. Defaults to 30.
+            connector (aiohttp.BaseConnector, optional): Shared connector (see AsyncAosPool).
+                Defaults to a private connector owned by this object.
+            use_session_cache (bool, optional): Reuse/store the login session in the session cache
+                if it's enabled in config.yaml. Defaults to True.
+            use_response_cache (bool, optional): Serve/store show command output from the response
+                cache if it's enabled in config.yaml. Defaults to True.
+        """
+        self.ip = ip
+        self.port = port
+        self.user = user
+        self.password = password
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.uid: str = None
+        self.session_cache: SessionCache = session_cache if use_session_cache else None
+        self.response_cache: ResponseCache = response_cache if use_response_cache else None
+        self._cache_key = SessionCache.key(ip, user, port)
+        self._connector = connector
+        self._session: aiohttp.ClientSession = None
+        self._login_lock: asyncio.Lock = None
+
+    def __repr__(self):
+        return f"<{self.__module__}.{type(self).__name__} ({self.ip}) object at {hex(id(self))}>"
+
+    async def __aenter__(self) -> "AsyncAosConnect":
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.close()
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """Keep-alive session for this controller, created on first use (must be called from a running loop)."""
+        if self._session is None or self._session.closed:
+            connector = self._connector or aiohttp.TCPConnector(limit_per_host=self.limit_per_host, ssl=False)
+            self._session = aiohttp.ClientSession(
+                base_url=f"https://{self.ip}:{self.port}",
+                connector=connector,
+                connector_owner=self._connector is None,
+                cookie_jar=aiohttp.CookieJar(unsafe=True),  # unsafe allows cookies from IP address hosts
+                headers=headers,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    async def api_login(self, use_cache: bool = True) -> Response:
+        """
+        This function will login into the controller using API.
+        A cached session is used if the session cache is enabled and has a valid entry.
+        :return: Response object, UIDARUBA is stored in the uid attribute.
+        """
+        if not self.ip:
+            return Response(ok=False, error="No IP address")
+
+        if use_cache and self.session_cache:
+            uid = self.session_cache.get(self._cache_key)
+            if uid:
+                self.uid = uid
+                self.session.cookie_jar.update_cookies({"SESSION": uid}, URL(f"https://{self.ip}:{self.port}"))
+                return Response(ok=True, output="cached session", json={"_global_result": {"UIDARUBA": uid}})
+
+        payload = {'username': self.user, 'password': self.password}
+        try:
+            with metrics.timer("api_login", self.ip) as call:
+                async with self.session.post("/v1/api/login", data=payload, ssl=False) as r:
+                    text = await r.text()
+                    call.ok, call.bytes = r.ok, len(text)
+                    data = await r.json(content_type=None)
+                    cookie = r.cookies.get("SESSION")
+                    self.uid = cookie.value if cookie else data.get("_global_result", {}).get("UIDARUBA")
+                    ok = r.ok and self.uid is not None
+                    if ok and self.session_cache:
+                        self.session_cache.set(self._cache_key, self.uid)
+                    return Response(ok=ok, output=text, json=data, status_code=r.status, error=None if ok else r.reason)
+        except Exception as err:
+            return Response(ok=False, error=err)
+
+    async def _ensure_login(self) -> Response:
+        if self._login_lock is None:
+            self._login_lock = asyncio.Lock()
+        async with self._login_lock:
+            if self.uid is not None:
+                return Response(ok=True)
+            return await self.api_login()
+
+    async def _relogin(self, stale_uid: str) -> Response:
+        """Login again after a 401 on stale_uid, once, however many tasks saw the 401."""
+        if self._login_lock is None:
+            self._login_lock = asyncio.Lock()
+        async with self._login_lock:
+            if self.uid is not None and self.uid != stale_uid:  # another task already logged in again
+                return Response(ok=True, output="session renewed")
+            log.info(f"{self.ip}: API session expired, logging in again")
+            if self.session_cache:
+                self.session_cache.invalidate(self._cache_key)
+            return await self.api_login(use_cache=False)
+
+    async def execute_command(self, cmd: str, use_cache: bool = True, _retry: bool = True) -> Response:
+        """
+        This function will execute commands on controller and returns the output
+        Logs in first if there is no session yet, and again (retrying once) if the session has expired (401).
+        :param cmd: command to be executed on device
+        :param use_cache: Set False to bypass the response cache (the fresh result is still cached)
+        :return: data containing output of the command
+        """
+        if use_cache and self.response_cache:
+            cached = self.response_cache.get(self.ip, cmd)
+            if cached:
+                status_code, text = cached
+                return Response(ok=True, output=text, status_code=status_code, json=json.loads(text))
+
+        if self.uid is None:
+            r = await self._ensure_login()
+            if not r.ok:
+                return r
+
+        uid = self.uid
+        params = {"UIDARUBA": uid, "command": cmd}
+        try:
+            with metrics.timer("execute_command", self.ip, cmd) as call:
+                async with self.session.get("/v1/configuration/showcommand", params=params, ssl=False) as r:
+                    call.ok, call.retries = r.ok, int(r.status == 401 and _retry)
+                    if r.status == 401 and _retry:
+                        pass  # logged in again below, once the response is released
+                    elif r.ok:
+                        if self.session_cache:
+                            self.session_cache.touch(self._cache_key)
+                        text = await r.text()
+                        call.bytes = len(text)
+                        if self.response_cache:
+                            self.response_cache.set(self.ip, cmd, r.status, text)
+                        return Response(ok=True, output=text, status_code=r.status, json=json.loads(text))
+                    else:
+                        return Response(ok=False, error=r.reason, status_code=r.status)
+        except Exception as err:
+            return Response(ok=False, error=err)
+
+        login = await self._relogin(uid)
+        if not login.ok:
+            return login
+        return await self.execute_command(cmd, use_cache=False, _retry=False)
+
+    async def stream_command(
+        self, cmd: str, consume: Callable[[AsyncIterator[bytes]], Awaitable[Any]], _retry: bool = True
+    ) -> Response:
+        """Like execute_command, but the body is handed to consume in chunks as it arrives.
+
+        For large outputs (i.e. show ap database) the body is never held or decoded whole,
+        it is not served from or stored in the response cache for the same reason.
+
+        Args:
+            cmd (str): command to be executed on device
+            consume (Callable[[AsyncIterator[bytes]], Awaitable[Any]]): Coroutine function fed the
+                body chunks, i.e. one wrapping parse.iter_ap_database.
+
+        Returns:
+            Response: output is whatever consume returned, an exception in consume fails the Response.
+        """
+        if self.uid is None:
+            r = await self._ensure_login()
+            if not r.ok:
+                return r
+
+        uid = self.uid
+        params = {"UIDARUBA": uid, "command": cmd}
+        try:
+            with metrics.timer("execute_command", self.ip, cmd) as call:
+                async with self.session.get("/v1/configuration/showcommand", params=params, ssl=False) as r:
+                    call.ok, call.retries = r.ok, int(r.status == 401 and _retry)
+                    if r.status == 401 and _retry:
+                        pass  # logged in again below, once the response is released
+                    elif r.ok:
+                        if self.session_cache:
+                            self.session_cache.touch(self._cache_key)
+
+                        async def _chunks() -> AsyncIterator[bytes]:
+                            async for chunk in r.content.iter_chunked(65536):
+                                call.bytes += len(chunk)
+                                yield chunk
+
+                        return Response(ok=True, output=await consume(_chunks()), status_code=r.status)
+                    else:
+                        return Response(ok=False, error=r.reason, status_code=r.status)
+        except Exception as err:
+            return Response(ok=False, error=err)
+
+        login = await self._relogin(uid)
+        if not login.ok:
+            return login
+        return await self.stream_command(cmd, consume, _retry=False)
+
+    async def logout(self) -> Response:
+        if self.uid is None or self._session is None or self._session.closed:
+            return Response(ok=True)
+        try:
+            async with self.session.get("/v1/api/logout", ssl=False) as r:
+                return Response(ok=r.ok, output=await r.text(), status_code=r.status)
+        except Exception as err:
+            return Response(ok=False, error=err)
+        finally:
+            self.uid = None
+
+    async def close(self, logout: bool = True) -> None:
+        """Logout (optional) and close the underlying session.
+
+        Sessions held in the session cache are left logged in so the next run can reuse them.
+        """
+        if logout and not self.session_cache:
+            await self.logout()
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+
+class AsyncAosPool:
+    def __init__(self, user: str, password: str, port: int = 4343, *,
+                 limit: int = 100, limit_per_host: int = 4, timeout: float = 30):
+        """One pooled AsyncAosConnect per controller, all sharing a single connector.
+
+        Args:
+            user (str): API username.
+            password (str): API password.
+            port (int, optional): API port. Defaults to 4343.
+            limit (int, optional): Max simultaneous connections across all controllers. Defaults to 100.
+            limit_per_host (int, optional): Max simultaneous connections to any one controller. Defaults to 4.
+            timeout (float, optional): Total timeout (seconds) for each request. Defaults to 30.
+        """
+        self.user = user
+        self.password = password
+        self.port = port
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.connections: Dict[str, AsyncAosConnect] = {}
+        self._connector: aiohttp.TCPConnector = None
+
+    async def __aenter__(self) -> "AsyncAosPool":
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.close()
+
+    def get(self, ip: str) -> AsyncAosConnect:
+        """Return the session for ip, creating it if needed."""
+        if self._connector is None or self._connector.closed:
+            self._connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host, ssl=False)
+        if ip not in self.connections:
+            self.connections[ip] = AsyncAosConnect(
+                ip, self.user, self.password, self.port, timeout=self.timeout, connector=self._connector
+            )
+        return self.connections[ip]
+
+    async def execute_command(self, ip: str, cmd: str) -> Response:
+        return await self.get(ip).execute_command(cmd)
+
+    async def stream_command(self, ip: str, cmd: str, consume: Callable[[AsyncIterator[bytes]], Awaitable[Any]]) -> Response:
+        return await self.get(ip).stream_command(cmd, consume)
+
+    async def batch(self, calls: Iterable[Tuple[str, str]]) -> List[Response]:
+        """Run (ip, command) pairs concurrently, bounded by the pool connection limits.
+
+        Returns:
+            List[Response]: Responses in the same order as calls.
+        """
+        return await asyncio.gather(*[self.execute_command(ip, cmd) for ip, cmd in calls])
+
+    async def close(self, logout: bool = True) -> None:
+        """Logout (optional) of every controller and release all pooled connections."""
+        res = await asyncio.gather(*[con.close(logout=logout) for con in self.connections.values()], return_exceptions=True)
+        for ip, r in zip(self.connections, res):
+            if isinstance(r, Exception):
+                log.error(f"{ip}: Error on session close {r}")
+        self.connections = {}
+        if self._connector is not None and not self._connector.closed:
+            await self._connector.close()
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+#
+# Author: Wade Wells github/Pack3tL0ss
+"""On-disk caches shared by the API clients."""
+from __future__ import annotations
+
+import atexit
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Union
+
+
+class SessionCache:
+    def __init__(self, path: Union[str, Path], ttl: int = 600):
+        """Persistent cache of API login sessions (UIDARUBA) keyed by user@controller:port.
+
+        Entries expire ttl seconds after they were last used, the expiry slides forward each
+        time a cached session is used successfully.  The file holds live session tokens so
+        it is written with owner only permissions.
+
+        Args:
+            path (Union[str, Path]): json file used to persist sessions between runs.
+            ttl (int, optional): Seconds of idle time before a session is considered stale,
+                should be less than the controllers API session timeout. Defaults to 600.
+        """
+        self.path = Path(path)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._data: Dict[str, dict] = self._load()
+        atexit.register(self.flush)
+
+    @staticmethod
+    def key(ip: str, user: str, port: int) -> str:
+        return f"{user}@{ip}:{port}"
+
+    def _load(self) -> Dict[str, dict]:
+        try:
+            data = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return {}
+        now = time.time()
+        return {k: v for k, v in data.items() if v.get("expires", 0) > now}
+
+    def _save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(self._data, f)
+        os.replace(tmp, self.path)
+        self._dirty = False
+
+    def get(self, key: str) -> Optional[str]:
+        """Return cached session id for key, None if not cached or expired."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry and entry["expires"] > time.time():
+                return entry["uid"]
+        return None
+
+    def set(self, key: str, uid: str) -> None:
+        with self._lock:
+            self._data[key] = {"uid": uid, "expires": time.time() + self.ttl}
+            self._save()
+
+    def touch(self, key: str) -> None:
+        """Slide expiry of key forward after a successful call.  Persisted on flush."""
+        with self._lock:
+            if key in self._data:
+                self._data[key]["expires"] = time.time() + self.ttl
+                self._dirty = True
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            if self._data.pop(key, None) is not None:
+                self._save()
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._dirty:
+                self._save()
+
+
+# Default seconds to cache each command (longest matching prefix wins), commands not matched are not cached.
+DEFAULT_TTLS = {
+    "show switches": 60,
+    "show vrrp": 300,
+    "show image version": 3600,
+    "show web-server profile": 3600,
+    "show crypto pki ServerCert": 3600,
+}
+
+
+class ResponseCache:
+    def __init__(self, ttls: Dict[str, int] = None, maxsize: int = 5000, path: Union[str, Path] = None):
+        """TTL/LRU cache of successful show command output keyed by (controller, command).
+
+        Args:
+            ttls (Dict[str, int], optional): Seconds to cache by command prefix, longest prefix wins.
+                Merged over DEFAULT_TTLS, a ttl of 0 disables caching for that prefix.
+            maxsize (int, optional): Max entries held, least recently used are evicted. Defaults to 5000.
+            path (Union[str, Path], optional): json file used to persist the cache between runs.
+                Defaults to None (memory only).
+        """
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+        self._prefixes = sorted(self.ttls, key=len, reverse=True)
+        self.maxsize = maxsize
+        self.path = None if not path else Path(path)
+        self.hits = self.misses = 0
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._data: OrderedDict[str, list] = self._load()
+        if self.path:
+            atexit.register(self.flush)
+
+    @staticmethod
+    def key(ip: str, cmd: str) -> str:
+        return f"{ip}|{cmd}"
+
+    def ttl(self, cmd: str) -> int:
+        for prefix in self._prefixes:
+            if cmd.startswith(prefix):
+                return self.ttls[prefix]
+        return 0
+
+    def _load(self) -> OrderedDict:
+        if not self.path:
+            return OrderedDict()
+        try:
+            data = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return OrderedDict()
+        now = time.time()
+        return OrderedDict((k, v) for k, v in data.items() if v[0] > now)
+
+    def get(self, ip: str, cmd: str) -> Optional[Tuple[int, str]]:
+        """Return cached (status_code, text) for cmd on ip, None on miss or if expired."""
+        key = self.key(ip, cmd)
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] <= time.time():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1], entry[2]
+
+    def set(self, ip: str, cmd: str, status_code: int, text: str) -> None:
+        ttl = self.ttl(cmd)
+        if not ttl:
+            return
+        key = self.key(ip, cmd)
+        with self._lock:
+            self._data[key] = [time.time() + ttl, status_code, text]
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+            self._dirty = True
+
+    def invalidate(self, ip: str, cmd_prefix: str) -> int:
+        """Drop the cached output of every command on ip starting with cmd_prefix (i.e. after a config change).
+
+        Returns:
+            int: Number of entries dropped.
+        """
+        prefix = self.key(ip, cmd_prefix)
+        with self._lock:
+            keys = [k for k in self._data if k.startswith(prefix)]
+            for k in keys:
+                del self._data[k]
+            self._dirty = self._dirty or bool(keys)
+        return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._dirty = True
+
+    def flush(self) -> None:
+        if not self.path:
+            return
+        with self._lock:
+            if self._dirty:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                tmp = self.path.with_suffix(".tmp")
+                tmp.write_text(json.dumps(self._data))
+                os.replace(tmp, self.path)
+                self._dirty = False
+
+
+class CertCache:
+    def __init__(self, path: Union[str, Path] = None, refresh_before: int = 7 * 86400):
+        """Parsed show crypto pki ServerCert details keyed by (config node, cert name).
+
+        An entry is reused until the cert it describes is within refresh_before seconds of
+        expiring, a new cert name is a new key so a changed cert is always fetched.
+
+        Args:
+            path (Union[str, Path], optional): json file used to persist the cache between runs.
+                Defaults to None (memory only).
+            refresh_before (int, optional): Seconds before expiry an entry stops being used. Defaults to 7 days.
+        """
+        self.path = None if not path else Path(path)
+        self.refresh_before = refresh_before
+        self.hits = self.misses = 0
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._data: Dict[str, dict] = self._load()
+        self._key_locks: Dict[str, threading.Lock] = {}
+        if self.path:
+            atexit.register(self.flush)
+
+    @staticmethod
+    def key(node: str, name: str) -> str:
+        return f"{node}|{name}"
+
+    def lock(self, node: str, name: str) -> threading.Lock:
+        """Per key lock, hold it across get/fetch/set so concurrent lookups of the same cert wait on the first fetch."""
+        with self._lock:
+            return self._key_locks.setdefault(self.key(node, name), threading.Lock())
+
+    def _load(self) -> Dict[str, dict]:
+        if not self.path:
+            return {}
+        try:
+            return json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, node: str, name: str) -> Optional[dict]:
+        """Cached cert data (as parse.show_crypto_pki_servercert returns it), None on miss or if near expiry."""
+        with self._lock:
+            entry = self._data.get(self.key(node, name))
+            exp = None if not entry or not entry.get("cert_exp_date") else datetime.fromisoformat(entry["cert_exp_date"])
+            if exp is None or exp.timestamp() - time.time() <= self.refresh_before:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return {**entry, "cert_exp_date": exp}
+
+    def set(self, node: str, name: str, data: dict) -> None:
+        if not data.get("cert_exp_date"):
+            return
+        with self._lock:
+            self._data[self.key(node, name)] = {
+                **data, "cert_exp_date": data["cert_exp_date"].isoformat(), "seen": time.time()
+            }
+            self._dirty = True
+
+    def flush(self) -> None:
+        if not self.path:
+            return
+        with self._lock:
+            if self._dirty:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                tmp = self.path.with_suffix(".tmp")
+                tmp.write_text(json.dumps(self._data))
+                os.replace(tmp, self.path)
+                self._dirty = False
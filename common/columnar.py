@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+#
+# Author: Wade Wells github/Pack3tL0ss
+"""Columnar, dictionary encoded store for fleet-wide AP inventory.
+
+Low cardinality columns (model, group, status, switch_ip) are stored as an
+array of small integer codes plus the list of distinct values, so 100k+ APs
+take a few hundred KB and group-by counts are a single pass over int arrays.
+"""
+from __future__ import annotations
+
+import json
+import os
+import time
+from array import array
+from collections import Counter
+from itertools import compress
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from .device import APRecord
+
+ENCODED = ("model", "group", "status", "switch_ip")
+PLAIN = ("name", "ip")
+
+
+class DictColumn:
+    """Dictionary encoded column: codes (array of uint32) index into values."""
+    def __init__(self, values: List[str] = None, codes: array = None):
+        self.values: List[Optional[str]] = values or []
+        self.codes = codes if codes is not None else array("I")
+        self._index: Dict[Optional[str], int] = {v: i for i, v in enumerate(self.values)}
+
+    def append(self, value: Optional[str]) -> None:
+        code = self._index.get(value)
+        if code is None:
+            code = self._index[value] = len(self.values)
+            self.values.append(value)
+        self.codes.append(code)
+
+    def code(self, value: Optional[str]) -> Optional[int]:
+        return self._index.get(value)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, idx: int) -> Optional[str]:
+        return self.values[self.codes[idx]]
+
+
+class APInventory:
+    def __init__(self):
+        """AP inventory held column by column.
+
+        Status is stored as its first word ("Up", "Down", ...), the uptime AOS appends
+        to "Up" would otherwise make every value distinct.
+        """
+        self.columns: Dict[str, DictColumn] = {c: DictColumn() for c in ENCODED}
+        self.name: List[str] = []
+        self.ip: List[str] = []
+        self.collected: float = None
+
+    def __len__(self):
+        return len(self.name)
+
+    @classmethod
+    def from_records(cls, records: Iterable[APRecord]) -> "APInventory":
+        inv = cls()
+        for ap in records:
+            inv.append(ap)
+        inv.collected = time.time()
+        return inv
+
+    def append(self, ap: APRecord) -> None:
+        self.name.append(ap.name)
+        self.ip.append(ap.ip)
+        self.columns["model"].append(ap.model)
+        self.columns["group"].append(ap.group)
+        self.columns["status"].append(None if not ap.status else ap.status.split()[0])
+        self.columns["switch_ip"].append(ap.switch_ip)
+
+    def count_by(self, *columns: str, where: Dict[str, str] = None) -> Counter:
+        """Count APs by the given encoded columns, optionally filtered on column == value.
+
+        i.e. count_by("group", "switch_ip", where={"status": "Down"}) -> Counter({(group, switch_ip): count})
+        """
+        codes = [self.columns[c].codes for c in columns]
+        rows = zip(*codes)
+        for c, v in (where or {}).items():
+            code = self.columns[c].code(v)
+            if code is None:
+                return Counter()
+            rows = compress(rows, map(code.__eq__, self.columns[c].codes))
+        counts = Counter(rows)
+        values = [self.columns[c].values for c in columns]
+        return Counter({tuple(v[code] for v, code in zip(values, key)): n for key, n in counts.items()})
+
+    def save(self, path: Union[str, Path]) -> None:
+        """Persist to directory path (replaces any previous snapshot there)."""
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        meta = {
+            "count": len(self),
+            "collected": self.collected,
+            "values": {c: self.columns[c].values for c in ENCODED},
+        }
+        for c in ENCODED:
+            with (path / f"{c}.bin.tmp").open("wb") as f:
+                self.columns[c].codes.tofile(f)
+            os.replace(path / f"{c}.bin.tmp", path / f"{c}.bin")
+        for c in PLAIN:
+            (path / f"{c}.txt.tmp").write_text("\n".join(v or "" for v in getattr(self, c)))
+            os.replace(path / f"{c}.txt.tmp", path / f"{c}.txt")
+        # meta last, a snapshot is only valid once it's written
+        (path / "meta.json.tmp").write_text(json.dumps(meta))
+        os.replace(path / "meta.json.tmp", path / "meta.json")
+
+    @classmethod
+    def load(cls, path: Union[str, Path], columns: Tuple[str, ...] = (*ENCODED, *PLAIN)) -> "APInventory":
+        """Load a snapshot saved with save, only the columns requested are read from disk."""
+        path = Path(path)
+        meta = json.loads((path / "meta.json").read_text())
+        inv = cls()
+        inv.collected = meta["collected"]
+        for c in ENCODED:
+            codes = array("I")
+            if c in columns:
+                with (path / f"{c}.bin").open("rb") as f:
+                    codes.fromfile(f, meta["count"])
+            inv.columns[c] = DictColumn(meta["values"][c], codes)
+        for c in PLAIN:
+            if c in columns:
+                text = (path / f"{c}.txt").read_text()
+                setattr(inv, c, text.split("\n") if meta["count"] else [])
+        return inv
@@ -5,17 +5,18 @@ from __future__ import annotations
 
 from pathlib import Path
 from typing import Any
-import yaml
 from typing import Dict, List
 
 
 class Cert:
-    def __init__(self, *, p12_name: str | None = None, p12_pass: str | None = None, dir: Path | None = None, tftp_svr: str | None = None, md_path: str | None = None):
+    def __init__(self, *, p12_name: str | None = None, p12_pass: str | None = None, dir: Path | None = None, tftp_svr: str | None = None, md_path: str | None = None,
+                 md_paths: Dict[str, str] | None = None):
         self.p12_name: str | None = p12_name
         self.p12_pass: str | None = p12_pass
         self.dir: Path | None = dir
         self.tftp_svr: str | None = tftp_svr
         self.md_path: str | None = md_path
+        self.md_paths: Dict[str, str] = md_paths or {}  # md name or ip -> config node, overrides md_path
 
     def ok(self):
         name_pass_ok = True if any([x is None for x in [self.p12_name, self.p12_pass]]) else False
@@ -26,11 +27,38 @@ class Config:
     def __init__(self, base_dir: Path = None):
         BASE_DIR = base_dir or Path(__file__).parent.parent
         yaml_config = BASE_DIR / 'config.yaml'
+        self.cache_dir: Path = BASE_DIR / '.cache'
         self.data: dict = self.get_yaml_file(yaml_config) or {}
         self.DEBUG: bool = self.data.get("debug", False)
+        self.log_json: bool = self.data.get("log_json", False)
         self.conductors: List[str] = self.data.get("conductors", [])
         self.user: str | None = self.data.get("user")
-        self.password: str | None = self.data.get("password")
+        self.password: str | None = self.data.get("password", self.data.get("pass"))
+        self.workers: int = self.data.get("workers", 16)
+        self.rate_limit: float = self.data.get("rate_limit", 10)
+        # conductor_rate_limit is the old name, it was applied per discovering conductor rather than per controller
+        self.controller_rate_limit: float = self.data.get("controller_rate_limit", self.data.get("conductor_rate_limit", 0))
+        self.api_timeout: float = self.data.get("api_timeout", 30)
+        self.pipeline_concurrency: int = self.data.get("pipeline_concurrency", 4)
+        self.cert_sync_workers: Dict[str, int] = {
+            "profile": 16, "cert": 8, "compare": 2, "push": 1, **self.data.get("cert_sync_workers", {})
+        }
+        self.cert_sync_queue: int = self.data.get("cert_sync_queue", 64)
+        self.ssh_concurrency: int = self.data.get("ssh_concurrency", 20)
+        self.ssh_timeout: int = self.data.get("ssh_timeout", 30)
+        self.dns_cache_ttl: int = self.data.get("dns_cache_ttl", 300)
+        self.dns_cache_persist: bool = self.data.get("dns_cache_persist", False)
+        self.dns_timeout: float = self.data.get("dns_timeout", 5)
+        self.session_cache: bool = self.data.get("session_cache", False)
+        self.session_cache_ttl: int = self.data.get("session_cache_ttl", 600)
+        self.response_cache: bool = self.data.get("response_cache", False)
+        self.response_cache_persist: bool = self.data.get("response_cache_persist", True)
+        self.response_cache_size: int = self.data.get("response_cache_size", 5000)
+        self.response_cache_ttl: Dict[str, int] = self.data.get("response_cache_ttl", {})
+        self.metrics: bool = self.data.get("metrics", False)
+        self.metrics_dir: Path | None = None if not self.data.get("metrics_dir") else Path(self.data["metrics_dir"])
+        self.cert_cache_persist: bool = self.data.get("cert_cache_persist", False)
+        self.cert_cache_refresh_days: float = self.data.get("cert_cache_refresh_days", 7)
         self.cert: Cert = Cert(**self.data.get("cert", {}))
 
     def __bool__(self):
@@ -51,6 +79,8 @@ class Config:
     def get_yaml_file(yaml_config: Path) -> Dict:
         '''Return dict from yaml file.'''
         if yaml_config.exists() and yaml_config.stat().st_size > 0:
+            import yaml  # only needed once there is a config to read
+
             with yaml_config.open() as f:
                 try:
                     return yaml.load(f, Loader=yaml.SafeLoader)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+#
+# Author: Wade Wells github/Pack3tL0ss
+"""Compact device records shared by the scripts."""
+from __future__ import annotations
+
+from operator import attrgetter
+from typing import TYPE_CHECKING, Any, Dict, NamedTuple, Optional, Tuple
+
+if TYPE_CHECKING:
+    from .parse import ImageVersion
+
+# show switches key -> ManagedDevice attribute
+SWITCH_FIELDS = {
+    "Name": "name",
+    "Config ID": "cfg_id",
+    "Config Sync Time (sec)": "sync_time",
+    "Configuration State": "cfg_state",
+    "IP Address": "ip",
+    "Location": "location",
+    "Model": "model",
+    "Status": "status",
+    "Type": "type",
+    "Version": "version",
+}
+
+
+class ManagedDevice:
+    """A Mobility Conductor or Managed Device as reported by show switches.
+
+    Slotted so large estates don't carry a __dict__ per device.  Attributes not
+    yet known are None.
+    """
+    __slots__ = (*SWITCH_FIELDS.values(), "version_0_0", "version_0_1", "default_boot", "image", "connection", "portal")
+
+    CSV_FIELDS: Tuple[str, ...] = (*SWITCH_FIELDS.values(), "version_0_0", "version_0_1", "default_boot")
+    CSV_HEADER: Tuple[str, ...] = (*SWITCH_FIELDS.values(), "version 0:0", "version 0:1", "default_boot")
+    _csv_getter = attrgetter(*CSV_FIELDS)
+
+    name: Optional[str]
+    cfg_id: Optional[str]
+    sync_time: Optional[str]
+    cfg_state: Optional[str]
+    ip: Optional[str]
+    location: Optional[str]
+    model: Optional[str]
+    status: Optional[str]
+    type: Optional[str]
+    version: Optional[str]
+    version_0_0: Optional[str]
+    version_0_1: Optional[str]
+    default_boot: Optional[str]
+    image: Optional[ImageVersion]
+    connection: Any
+    portal: Any
+
+    def __init__(self, data: dict = None, connection=None):
+        for attr in self.__slots__:
+            setattr(self, attr, None)
+        self.connection = connection
+        if data:
+            self.update_data(data)
+
+    def update_data(self, data: dict) -> None:
+        """Update from a device entry in show switches output."""
+        for key, attr in SWITCH_FIELDS.items():
+            setattr(self, attr, data.get(key))
+
+    def update_image(self, image: ImageVersion) -> None:
+        """Update partition details from parse.show_image_version output."""
+        self.image = image
+        self.version_0_0 = image.version("0:0")
+        self.version_0_1 = image.version("0:1")
+        self.default_boot = image.default_boot
+
+    @property
+    def partitions(self) -> Dict[str, Optional[str]]:
+        """version by partition, includes any partitions beyond 0:0 and 0:1."""
+        if self.image is not None:
+            return {p.name: p.version for p in self.image.partitions}
+        return {"0:0": self.version_0_0, "0:1": self.version_0_1}
+
+    def csv_row(self) -> tuple:
+        """Values in CSV_FIELDS order."""
+        return self._csv_getter(self)
+
+    def __repr__(self):
+        return "".join(
+            [f" ---- {self.name} ----\n", *[f" {k}: {v}\n" for k, v in zip(self.CSV_HEADER, self.csv_row()) if v is not None]]
+        )
+
+    def _repr_csv_(self):
+        """csv representation
+
+        Returns:
+            tuple: commas seperated values of class attributes: (keys, values)
+        """
+        return ",".join(self.CSV_HEADER), ",".join("" if v is None else str(v) for v in self.csv_row())
+
+
+# show ap database key -> APRecord field
+AP_FIELDS = {
+    "Name": "name",
+    "IP Address": "ip",
+    "Group": "group",
+    "Status": "status",
+    "Switch IP": "switch_ip",
+    "AP Type": "model",
+    "Flags": "flags",
+    "Standby IP": "standby_ip",
+}
+
+
+class APRecord(NamedTuple):
+    """An AP from show ap database, a plain tuple so 10k's of them stay cheap."""
+    name: Optional[str]
+    ip: Optional[str]
+    group: Optional[str] = None
+    status: Optional[str] = None
+    switch_ip: Optional[str] = None
+    model: Optional[str] = None
+    flags: Optional[str] = None
+    standby_ip: Optional[str] = None
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "APRecord":
+        """Build from an entry in show ap database json (no validation)."""
+        return cls._make(map(data.get, AP_FIELDS))
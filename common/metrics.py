@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+#
+# Author: Wade Wells github/Pack3tL0ss
+"""Latency/bytes/retry/failure metrics for the API and SSH calls.
+
+Calls are recorded by (operation, device, command), i.e. ("execute_command",
+"10.0.30.104", "show switches").  Each key gets a fixed bucket latency
+histogram plus byte, retry and failure counters.  Exported at the end of a run
+as json and as a Prometheus textfile (node_exporter textfile collector format).
+
+Only the command's keywords are recorded, never its arguments (cert names,
+paths, passphrases), see command_template.  The number of keys is capped,
+calls past the cap are recorded under the device "_other".
+"""
+from __future__ import annotations
+
+import json
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, Tuple, Union
+
+# upper bounds (seconds), +Inf is implied
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+Key = Tuple[str, str, str]  # operation, device, command
+
+MAX_SERIES = 2000  # max keys, calls with a new key past this are recorded under device "_other"
+_KEYWORD = re.compile(r"^[a-z][a-z\-]*$")
+_MAX_KEYWORDS = 4
+_SECRET_WORDS = {"password", "passwd", "pass", "secret", "key", "psk"}  # anything after these is a secret
+
+
+def command_template(command: str) -> str:
+    """Leading keywords of a CLI/API command, the arguments are dropped.
+
+    i.e. "show crypto pki ServerCert LE_Dec25" -> "show crypto pki",
+    "crypto pki-import pkcs12 ServerCert name file.p12 passphrase" -> "crypto pki-import".
+    Multi-line (confirmation) input is reduced to its first line.
+    """
+    words = []
+    for word in command.strip().split("\n")[0].split():
+        if len(words) == _MAX_KEYWORDS or not _KEYWORD.match(word):
+            break
+        words.append(word)
+        if word in _SECRET_WORDS:
+            break
+    return " ".join(words)
+
+
+class CallStats:
+    __slots__ = ("buckets", "count", "sum", "max", "bytes", "retries", "failures")
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)  # per bucket (not cumulative), last is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.bytes = 0
+        self.retries = 0
+        self.failures = 0
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count, "sum": round(self.sum, 6), "max": round(self.max, 6),
+            "buckets": dict(zip([*map(str, BUCKETS), "+Inf"], self.buckets)),
+            "bytes": self.bytes, "retries": self.retries, "failures": self.failures,
+        }
+
+
+class Call:
+    """Handed to the caller by Metrics.timer to report the outcome of the call."""
+    __slots__ = ("ok", "bytes", "retries")
+
+    def __init__(self):
+        self.ok = True
+        self.bytes = 0
+        self.retries = 0
+
+
+class Metrics:
+    def __init__(self, max_series: int = MAX_SERIES):
+        self.max_series = max_series
+        self.stats: Dict[Key, CallStats] = {}
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def observe(self, op: str, device: str, command: str = "", seconds: float = 0.0, *,
+                ok: bool = True, nbytes: int = 0, retries: int = 0) -> None:
+        """Record a single call (command is reduced to its command_template)."""
+        key = (op, str(device), command_template(command))
+        with self._lock:
+            s = self.stats.get(key)
+            if s is None:
+                if len(self.stats) >= self.max_series:
+                    key = (op, "_other", key[2])
+                    s = self.stats.get(key)
+                if s is None:
+                    s = self.stats[key] = CallStats()
+            s.buckets[bisect_left(BUCKETS, seconds)] += 1
+            s.count += 1
+            s.sum += seconds
+            if seconds > s.max:
+                s.max = seconds
+            s.bytes += nbytes
+            s.retries += retries
+            if not ok:
+                s.failures += 1
+
+    @contextmanager
+    def timer(self, op: str, device: str, command: str = "") -> Iterator[Call]:
+        """Time the enclosed call, an exception counts as a failure (and is re-raised).
+
+            with metrics.timer("execute_command", ip, cmd) as call:
+                r = ...
+                call.ok, call.bytes = r.ok, len(r.content)
+        """
+        call = Call()
+        start = time.perf_counter()
+        try:
+            yield call
+        except BaseException:
+            call.ok = False
+            raise
+        finally:
+            self.observe(op, device, command, time.perf_counter() - start, ok=call.ok, nbytes=call.bytes, retries=call.retries)
+
+    def __len__(self):
+        return len(self.stats)
+
+    def to_json(self) -> dict:
+        with self._lock:
+            return {
+                "started": self.started,
+                "finished": time.time(),
+                "buckets": list(BUCKETS),
+                "calls": [
+                    {"op": op, "device": device, "command": command, **s.as_dict()}
+                    for (op, device, command), s in sorted(self.stats.items())
+                ],
+            }
+
+    def to_prometheus(self, prefix: str = "aos8") -> str:
+        def _labels(op: str, device: str, command: str, **extra: str) -> str:
+            labels = {"op": op, "device": device, "command": command, **extra}
+            return ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+
+        lines = [
+            f"# HELP {prefix}_call_duration_seconds Latency of API/SSH calls.",
+            f"# TYPE {prefix}_call_duration_seconds histogram",
+        ]
+        with self._lock:
+            items = sorted(self.stats.items())
+            for key, s in items:
+                cumulative = 0
+                for le, n in zip([*map(str, BUCKETS), "+Inf"], s.buckets):
+                    cumulative += n
+                    lines.append(f"{prefix}_call_duration_seconds_bucket{{{_labels(*key, le=le)}}} {cumulative}")
+                lines.append(f"{prefix}_call_duration_seconds_sum{{{_labels(*key)}}} {s.sum:.6f}")
+                lines.append(f"{prefix}_call_duration_seconds_count{{{_labels(*key)}}} {s.count}")
+            for name, attr, help in (
+                ("received_bytes_total", "bytes", "Bytes received."),
+                ("retries_total", "retries", "Calls retried (i.e. re-login after session expiry)."),
+                ("failures_total", "failures", "Calls that failed."),
+            ):
+                lines += [f"# HELP {prefix}_{name} {help}", f"# TYPE {prefix}_{name} counter"]
+                lines += [f"{prefix}_{name}{{{_labels(*key)}}} {getattr(s, attr)}" for key, s in items]
+        return "\n".join(lines) + "\n"
+
+    def export(self, path: Union[str, Path], prefix: str = "aos8") -> None:
+        """Write path.json and path.prom (path is the common stem, i.e. logs/image_versions)."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        for suffix, text in ((".json", json.dumps(self.to_json(), indent=2)), (".prom", self.to_prometheus(prefix))):
+            out = path.with_suffix(suffix)
+            tmp = path.with_suffix(f"{suffix}.tmp")
+            tmp.write_text(text)
+            os.replace(tmp, out)  # textfile collector must never see a partial file
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
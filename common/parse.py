@@ -1,8 +1,14 @@
 
 
+import codecs
+import json
+import re
 from datetime import datetime, timezone
+from typing import AsyncIterator, List, NamedTuple, Optional, Tuple, Union
+
 from . import Response
 from . import log
+from .device import APRecord
 
 
 def show_switches(data: dict):
@@ -17,28 +23,141 @@ def show_switches(data: dict):
     return switch_dict
 
 
-def show_image_version(data):
+class Partition(NamedTuple):
+    name: str  # i.e. "0:0"
+    version: Optional[str]  # i.e. "8.6.0.4_74969"
+    default_boot: bool = False
+
+
+class ImageVersion(NamedTuple):
+    partitions: Tuple[Partition, ...] = ()
+
+    @property
+    def default_boot(self) -> Optional[str]:
+        """Name of the default boot partition."""
+        return next((p.name for p in self.partitions if p.default_boot), None)
+
+    def version(self, partition: str) -> Optional[str]:
+        return next((p.version for p in self.partitions if p.name == partition), None)
+
+    @classmethod
+    def from_json(cls, data: list) -> "ImageVersion":
+        """Rebuild from the json serialized form (json.dumps of an ImageVersion)."""
+        return cls(tuple(Partition(*p) for p in data[0]))
+
+
+# One match per partition: (partition, rest of partition line, software version, build number)
+_IMAGE_VERSION_RE = re.compile(
+    r"Partition[ \t]*: *(\d+:\d+)(.*)"
+    r"(?:\nSoftware Version[ \t]*: *(?:ArubaOS )?([^\s(]+).*(?:\nBuild number[ \t]*: *(\S+))?)?"
+)
+
+
+def show_image_version(data: dict) -> ImageVersion:
     """Parse return from show image version command
+
+    Single regex pass over the output, handles any number of partitions.
+
+    Args:
+        data (dict): json from show image version
+
+    Returns:
+        ImageVersion: Partitions in the order reported.
     """
-    data = data.get('_data', [])[0].split('\n')
-    img_dict = {}
-    _part = 'err'
-    for line in data:
-        if line.startswith("Partition"):
-            if '0:0' in line:
-                _part = '0:0'
-            elif '0:1' in line:
-                _part = '0:1'
-            if 'Default boot' in line:
-                img_dict['default_boot'] = f"0:{line.split(':')[2].replace(' **Default boot**', '')}"
-            continue
-        if line.startswith('Software Version'):
-            img_dict[f"version {_part}"] = line.split(':')[-1].replace('ArubaOS ', '').split('(')[0].strip()
-            # img_dict[f"version {_part}"] = img_dict[f"version {_part}"].split(' (Digitally')[0]
-        if line.startswith('Build num'):
-            img_dict[f"version {_part}"] += f"_{line.split(':')[-1].strip()}"
-
-    return img_dict
+    return ImageVersion(tuple([
+        Partition(name, None if not version else version if not build else f"{version}_{build}", "Default boot" in rest)
+        for name, rest, version, build in _IMAGE_VERSION_RE.findall("\n".join(data.get("_data", [])))
+    ]))
+
+
+class APDatabaseParser:
+    """Incremental parser for show ap database json.
+
+    Fed the response body in chunks, yields an APRecord for each entry in the
+    "AP Database" list as soon as it is complete, so the full body is never held
+    (or decoded) at once.  Other keys (_data, _meta) are ignored.
+    """
+    KEY = '"AP Database"'
+
+    def __init__(self, validate: bool = False):
+        """
+        Args:
+            validate (bool, optional): Validate each entry with the pydantic AccessPoint model
+                (slow path). Defaults to False.
+        """
+        self.validate = validate
+        self.count = 0
+        self._buf = ""
+        self._in_list = False
+        self._done = False
+        self._decoder = json.JSONDecoder()
+        self._text = codecs.getincrementaldecoder("utf-8")()
+        if validate:
+            from .models import AccessPoint
+            self._model = AccessPoint
+
+    def _record(self, data: dict) -> APRecord:
+        if self.validate:
+            ap = self._model.model_validate(data)
+            return APRecord(ap.name, ap.ip, ap.group, ap.status, ap.switch_ip, ap.model, ap.flags, ap.standby_ip)
+        return APRecord.from_dict(data)
+
+    def feed(self, chunk: Union[bytes, str]) -> List[APRecord]:
+        """Add the next chunk of the body, returns the APs completed by it."""
+        if self._done:
+            return []
+        buf = self._buf + (chunk if isinstance(chunk, str) else self._text.decode(chunk))
+        pos = 0
+        if not self._in_list:
+            idx = buf.find(self.KEY)
+            start = -1 if idx == -1 else buf.find("[", idx + len(self.KEY))
+            if start == -1:
+                # keep enough to match the key/bracket split across chunks
+                self._buf = buf[-(len(self.KEY) + 64):] if idx == -1 else buf[idx:]
+                return []
+            self._in_list = True
+            pos = start + 1
+
+        records = []
+        # fast path: decode every complete entry in the buffer with a single json.loads, entries are flat
+        # objects so the last "}" closes the last complete one.  Falls back to entry by entry decoding if
+        # that is not valid json (i.e. a "}" inside a value).
+        last = buf.rfind("}")
+        if last > pos:
+            try:
+                entries = json.loads(f"[{buf[pos:last + 1].strip().lstrip(',')}]")
+            except json.JSONDecodeError:
+                pass
+            else:
+                records = [self._record(data) for data in entries]
+                pos = last + 1
+
+        end = len(buf)
+        while pos < end:
+            c = buf[pos]
+            if c in " \t\r\n,":
+                pos += 1
+            elif c == "]":
+                self._done = True
+                break
+            else:
+                try:
+                    data, pos = self._decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    break  # incomplete entry, wait for more data
+                records.append(self._record(data))
+
+        self._buf = "" if self._done else buf[pos:]
+        self.count += len(records)
+        return records
+
+
+async def iter_ap_database(content: AsyncIterator[bytes], validate: bool = False) -> AsyncIterator[APRecord]:
+    """Stream APRecords from a show ap database response body (i.e. aiohttp resp.content.iter_chunked())."""
+    parser = APDatabaseParser(validate=validate)
+    async for chunk in content:
+        for ap in parser.feed(chunk):
+            yield ap
 
 
 def show_web_server_profile(data: Response) -> dict:
@@ -51,7 +170,7 @@ def show_web_server_profile(data: Response) -> dict:
         dict: Clean Return data from output of command
     """
     data = data.json()
-    key = data.get("Web Server Configuration", list(data.keys())[0])
+    key = "Web Server Configuration" if "Web Server Configuration" in data else list(data.keys())[0]
     if "Error" in key:
         try:
             log.error(key.split("(")[1].split(")")[0])
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+#
+# Author: Wade Wells github/Pack3tL0ss
+"""Run several show commands against one device over its existing API session.
+
+Independent commands are sent concurrently (up to a per-device limit), a command
+that depends on the output of another is chained from that command's callback,
+so a device costs roughly one round trip per dependency level.
+
+StagedPipeline does the same across devices: each device moves through a series
+of stages (i.e. fetch -> compare -> push), every stage with its own workers and a
+bounded queue in front of it, so a slow stage doesn't hold up the fast ones until
+its queue is full.
+"""
+from __future__ import annotations
+
+import queue
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Set, Union
+
+from . import AosConnect, Response, log
+
+
+class Command(NamedTuple):
+    """A show command and an optional callback ran with its Response.
+
+    The callback may return further commands (str or Command) which are then
+    submitted on the same session, this is how dependent commands are chained.
+    """
+    cmd: str
+    then: Optional[Callable[[Response], Optional[Iterable[Union[str, "Command"]]]]] = None
+
+
+class CommandPipeline:
+    def __init__(self, con: AosConnect, max_concurrent: int = 4):
+        """Pipeline of show commands for a single device.
+
+        Args:
+            con (AosConnect): Logged in session with the device.
+            max_concurrent (int, optional): Max commands in flight to this device at once. Defaults to 4.
+        """
+        self.con = con
+        self.max_concurrent = max_concurrent
+
+    def __repr__(self):
+        return f"<{self.__module__}.{type(self).__name__} ({self.con.ip}) object at {hex(id(self))}>"
+
+    def run(self, commands: Iterable[Union[str, Command]]) -> List[Response]:
+        """Run commands (and any chained from their callbacks) to completion.
+
+        Callbacks run in the thread that sent the command, an exception in a callback
+        is logged and ends that chain only.
+
+        Returns:
+            List[Response]: Response for each command in the order submitted, commands chained
+                from a callback follow the ones already submitted at the time.
+        """
+        results: List[Optional[Response]] = []
+        lock = threading.Lock()
+
+        def _run(idx: int, command: Command):
+            res = self.con.execute_command(command.cmd)
+            results[idx] = res
+            if command.then is None:
+                return ()
+            try:
+                return command.then(res) or ()
+            except Exception as e:
+                log.error(f"{self.con.ip}: Exception in callback for '{command.cmd}' {e.__class__.__name__} {e}")
+                return ()
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrent, thread_name_prefix=f"pipe-{self.con.ip}") as pool:
+            pending: Set[Future] = set()
+
+            def _submit(cmds: Iterable[Union[str, Command]]) -> None:
+                for c in cmds:
+                    c = Command(c) if isinstance(c, str) else c
+                    with lock:
+                        idx = len(results)
+                        results.append(None)  # reserve position so results keep submission order
+                    pending.add(pool.submit(_run, idx, c))
+
+            _submit(commands)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for f in done:
+                    _submit(f.result())
+
+        return results
+
+
+class Stage(NamedTuple):
+    """A step of a StagedPipeline.
+
+    func is called with each item and returns what is handed to the next stage,
+    None drops the item.  With batch > 1 func is called with a list of up to batch
+    items (whatever is queued when a worker frees up) and returns an iterable of items.
+    """
+    name: str
+    func: Callable[[Any], Any]
+    workers: int = 1
+    batch: int = 1
+
+
+_DONE = object()  # end of input marker, one per worker of the receiving stage
+
+
+class StagedPipeline:
+    def __init__(self, stages: Sequence[Stage], maxsize: int = 64):
+        """Items flow through stages in order, each stage running on its own worker threads.
+
+        Args:
+            stages (Sequence[Stage]): The stages, in order.
+            maxsize (int, optional): Max items queued in front of each stage, a stage that can't
+                keep up blocks the stage(s) before it once its queue is full. Defaults to 64.
+
+        Raises:
+            ValueError: If there are no stages, or a stage has workers or batch < 1.
+        """
+        if not stages:
+            raise ValueError("StagedPipeline needs at least one stage")
+        for stage in stages:
+            # a stage without workers would never pass on the end marker and run() would never return
+            if stage.workers < 1 or stage.batch < 1:
+                raise ValueError(f"stage {stage.name}: workers and batch must be >= 1, got {stage.workers} and {stage.batch}")
+        self.stages = list(stages)
+        self.maxsize = maxsize
+
+    def __repr__(self):
+        return f"<{self.__module__}.{type(self).__name__} ({' -> '.join(s.name for s in self.stages)}) object at {hex(id(self))}>"
+
+    def run(self, items: Iterable[Any]) -> Iterator[Any]:
+        """Feed items through every stage, yielding what comes out of the last stage as it completes.
+
+        An exception in a stage is logged and drops that item (or batch).  The output
+        queue is bounded as well, so the returned iterator must be consumed.
+        """
+        queues: List[queue.Queue] = [queue.Queue(self.maxsize) for _ in range(len(self.stages) + 1)]
+        remaining = [stage.workers for stage in self.stages]
+        lock = threading.Lock()
+
+        def _feed():
+            try:
+                for item in items:
+                    queues[0].put(item)
+            except Exception as e:
+                log.error(f"{self!r}: Exception reading input {e.__class__.__name__} {e}")
+            finally:
+                for _ in range(self.stages[0].workers):
+                    queues[0].put(_DONE)
+
+        def _worker(idx: int, stage: Stage):
+            in_q, out_q = queues[idx], queues[idx + 1]
+            done = False
+            while not done:
+                item = in_q.get()
+                if item is _DONE:
+                    break
+                batch = [item]
+                while len(batch) < stage.batch:
+                    try:
+                        item = in_q.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is _DONE:
+                        done = True
+                        break
+                    batch.append(item)
+                try:
+                    out = stage.func(batch) if stage.batch > 1 else [stage.func(item)]
+                    for o in out or ():
+                        if o is not None:
+                            out_q.put(o)
+                except Exception as e:
+                    log.error(f"pipeline stage {stage.name}: Exception {e.__class__.__name__} {e}")
+            with lock:
+                remaining[idx] -= 1
+                last = remaining[idx] == 0
+            if last:  # the next stage's workers (or the consumer) each get an end marker
+                for _ in range(1 if idx + 1 == len(self.stages) else self.stages[idx + 1].workers):
+                    out_q.put(_DONE)
+
+        threads = [threading.Thread(target=_feed, name="stage-feed", daemon=True)]
+        for idx, stage in enumerate(self.stages):
+            threads += [
+                threading.Thread(target=_worker, args=(idx, stage), name=f"stage-{stage.name}-{n}", daemon=True)
+                for n in range(stage.workers)
+            ]
+        for t in threads:
+            t.start()
+
+        while True:
+            item = queues[-1].get()
+            if item is _DONE:
+                break
+            yield item
+        for t in threads:
+            t.join()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+#
+# Author: Wade Wells github/Pack3tL0ss
+"""Concurrent, cached hostname resolution.
+
+All the hosts for a run are resolved up front in parallel (resolve_all), so a
+slow or flaky DNS server costs one timeout for the batch rather than a stall in
+front of every login.  Results are cached with a TTL, optionally on disk.
+"""
+from __future__ import annotations
+
+import atexit
+import ipaddress
+import json
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, Iterable, Tuple, Union
+
+
+class Resolver:
+    def __init__(self, ttl: int = 300, path: Union[str, Path] = None, workers: int = 32, timeout: float = 5):
+        """Hostname -> IPv4 address cache.
+
+        Args:
+            ttl (int, optional): Seconds a resolved address is reused. Defaults to 300.
+            path (Union[str, Path], optional): json file used to persist the cache between runs.
+                Defaults to None (memory only).
+            workers (int, optional): Max lookups in flight at once. Defaults to 32.
+            timeout (float, optional): Seconds resolve_all waits for the whole batch, hosts not
+                resolved by then are reported as failed. Defaults to 5.
+        """
+        self.ttl = ttl
+        self.path = None if not path else Path(path)
+        self.workers = workers
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._data: Dict[str, list] = self._load()
+        if self.path:
+            atexit.register(self.flush)
+
+    def _load(self) -> Dict[str, list]:
+        if not self.path:
+            return {}
+        try:
+            data = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return {}
+        now = time.time()
+        return {k: v for k, v in data.items() if v[1] > now}
+
+    @staticmethod
+    def _is_ip(host: str) -> bool:
+        try:
+            ipaddress.ip_address(host)
+        except ValueError:
+            return False
+        return True
+
+    def cached(self, host: str) -> str:
+        """Cached address for host (IP addresses are returned as is), None if not cached or expired."""
+        if self._is_ip(host):
+            return host
+        with self._lock:
+            entry = self._data.get(host)
+        if entry and entry[1] > time.time():
+            return entry[0]
+        return None
+
+    def _lookup(self, host: str) -> str:
+        ip = socket.gethostbyname(host)
+        with self._lock:
+            self._data[host] = [ip, time.time() + self.ttl]
+            self._dirty = True
+        return ip
+
+    def resolve(self, host: str) -> str:
+        """Address for host, from the cache if possible.
+
+        Raises:
+            socket.gaierror: If host can not be resolved.
+        """
+        return self.cached(host) or self._lookup(host)
+
+    def resolve_all(self, hosts: Iterable[str]) -> Tuple[Dict[str, str], Dict[str, str]]:
+        """Resolve every host concurrently (cache misses only).
+
+        Returns:
+            Tuple[Dict[str, str], Dict[str, str]]: ({host: ip} for those resolved, {host: error} for those that were not)
+        """
+        resolved, failed = {}, {}
+        todo = []
+        for host in dict.fromkeys(hosts):
+            ip = self.cached(host)
+            if ip:
+                resolved[host] = ip
+            else:
+                todo.append(host)
+        if todo:
+            # not a context manager, shutdown must not wait on lookups still stuck past the timeout
+            pool = ThreadPoolExecutor(max_workers=min(self.workers, len(todo)), thread_name_prefix="dns")
+            futures = {pool.submit(self._lookup, host): host for host in todo}
+            done, not_done = wait(futures, timeout=self.timeout)
+            pool.shutdown(wait=False)
+            for f in done:
+                if f.exception() is None:
+                    resolved[futures[f]] = f.result()
+                else:
+                    failed[futures[f]] = str(f.exception())
+            for f in not_done:
+                failed[futures[f]] = f"timed out after {self.timeout}s"
+        self.flush()
+        return resolved, failed
+
+    def flush(self) -> None:
+        if not self.path:
+            return
+        with self._lock:
+            if self._dirty:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                tmp = self.path.with_suffix(".tmp")
+                tmp.write_text(json.dumps(self._data))
+                os.replace(tmp, self.path)
+                self._dirty = False
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+#
+# Author: Wade Wells github/Pack3tL0ss
+"""Bounded, rate-limited fan-out of per-device work.
+
+Replaces one-thread-per-device with a fixed size worker pool, and meters job
+starts through token buckets (one overall and one per controller) so a large
+estate doesn't hit the controllers with hundreds of logins at once.  Both
+buckets hold a burst of workers tokens, the pool starts full and is then
+metered.  open_sessions is the login fan-out shared by the scripts.
+"""
+from __future__ import annotations
+
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from . import AosConnect, config, log, resolver
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int = None):
+        """Thread safe token bucket.
+
+        Args:
+            rate (float): tokens added per second.  0 or None means unlimited.
+            burst (int, optional): bucket size. Defaults to max(1, rate).
+        """
+        self.rate = rate or 0
+        self.capacity = burst or max(1, int(self.rate))
+        self._tokens = float(self.capacity)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Block until a token is available, then take it."""
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class Scheduler:
+    def __init__(self, workers: int = 16, rate: float = 0, per_key_rate: float = 0):
+        """Run jobs on a bounded worker pool with overall and per-key rate limits.
+
+        Args:
+            workers (int, optional): Max jobs running at once. Defaults to 16.
+            rate (float, optional): Max job starts per second across all keys (0 = unlimited). Defaults to 0.
+            per_key_rate (float, optional): Max job starts per second for any single key, i.e. the
+                controller logged in to (0 = unlimited). Defaults to 0.
+        """
+        self.workers = max(1, workers or 1)
+        self.per_key_rate = per_key_rate
+        self._bucket = TokenBucket(rate, burst=self.workers)
+        self._key_buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def _key_bucket(self, key: str) -> TokenBucket:
+        with self._lock:
+            if key not in self._key_buckets:
+                self._key_buckets[key] = TokenBucket(self.per_key_rate, burst=self.workers)
+            return self._key_buckets[key]
+
+    def _call(self, func: Callable, key: str, args: tuple) -> Any:
+        self._bucket.acquire()
+        self._key_bucket(key).acquire()
+        return func(*args)
+
+    def run(self, func: Callable, jobs: Iterable[Tuple[str, tuple]]) -> List[Any]:
+        """Call func(*args) for each (key, args) job, blocks until all complete.
+
+        Args:
+            func (Callable): Function to run for each job.
+            jobs (Iterable[Tuple[str, tuple]]): (rate limit key, args) for each job.
+
+        Returns:
+            List[Any]: Return from func for each job, in the order jobs were provided.
+        """
+        jobs = list(jobs)
+        if not jobs:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(jobs))) as pool:
+            futures = [pool.submit(self._call, func, key, args) for key, args in jobs]
+            return [f.result() for f in futures]
+
+
+def _get_session(dev: str, username: str, password: str) -> Optional[Tuple[str, AosConnect]]:
+    try:
+        ip = resolver.resolve(dev)
+        con = AosConnect(ip, user=username, password=password)
+        r = con.api_login(lazy=True)  # runs answered from the response cache don't log in
+        if r.ok:
+            log.info(f"{ip}: Session Estabished")
+            return ip, con
+        log.error(f"{dev}: Failure Establishing Session: {r.error}")
+    except socket.gaierror:
+        log.critical(f"{dev}: Unable to resolve host.")
+    except ConnectionRefusedError as e:
+        log.critical(f"{dev}: Unable to connect to Controller. Login Failed.\n{e}")
+    except Exception as e:
+        log.critical(f"{dev}: Exception Occured {e}")
+
+
+def open_sessions(devices: Iterable[str], username: str = None, password: str = None) -> Dict[str, AosConnect]:
+    """Login/establish session for each controller.
+
+    Hostnames are resolved up front in parallel, then logins run on a bounded worker
+    pool, rate limited overall and per controller (see workers, rate_limit and
+    controller_rate_limit in config.yaml).  Failures are logged and left out.
+
+    Args:
+        devices (Iterable[str]): Hostname or IP of each controller.
+        username (str, optional): Defaults to user from config.yaml.
+        password (str, optional): Defaults to password from config.yaml.
+
+    Returns:
+        Dict[str, AosConnect]: Session for each controller logged in to, keyed by IP.
+    """
+    devices = list(devices)
+    # resolved up front in parallel, _get_session then hits the resolver cache
+    resolved, failed = resolver.resolve_all(devices)
+    if failed:
+        log.critical([f"Unable to resolve {len(failed)} host(s):", *[f"  {host}: {err}" for host, err in failed.items()]])
+    username, password = username or config.user, password or config.password
+    scheduler = Scheduler(config.workers, rate=config.rate_limit, per_key_rate=config.controller_rate_limit)
+    jobs = [(resolved[dev], (dev, username, password)) for dev in devices if dev in resolved]
+    return dict(r for r in scheduler.run(_get_session, jobs) if r)
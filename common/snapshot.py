@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+#
+# Author: Wade Wells github/Pack3tL0ss
+"""SQLite snapshot of the last known state of each Managed Device.
+
+Used for incremental refresh, an MD whose Config ID, Version and Status (from
+show switches) match the snapshot can reuse the stored data rather than being
+logged into and queried again.
+"""
+from __future__ import annotations
+
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Optional, Union
+
+# show switches fields which, if changed, mean the device needs to be queried again
+CHANGE_FIELDS = ("Config ID", "Version", "Status")
+
+
+class InventorySnapshot:
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS devices ("
+            "ip TEXT PRIMARY KEY, name TEXT, cfg_id TEXT, version TEXT, status TEXT, data TEXT, updated REAL)"
+        )
+        self._db.commit()
+
+    @staticmethod
+    def _state(switch_data: dict) -> tuple:
+        return tuple(None if switch_data.get(f) is None else str(switch_data[f]) for f in CHANGE_FIELDS)
+
+    def unchanged(self, ip: str, switch_data: dict) -> Optional[Any]:
+        """Return the stored data for ip if its show switches state is unchanged since it was stored.
+
+        Args:
+            ip (str): IP of the Managed Device.
+            switch_data (dict): The devices entry from show switches.
+
+        Returns:
+            Optional[Any]: Stored (json decoded) data, None if the device is not in the snapshot or has changed.
+        """
+        with self._lock:
+            row = self._db.execute("SELECT cfg_id, version, status, data FROM devices WHERE ip = ?", (ip,)).fetchone()
+        if row is None or tuple(row[0:3]) != self._state(switch_data):
+            return None
+        return json.loads(row[3])
+
+    def save(self, ip: str, switch_data: dict, data: Any) -> None:
+        """Store data (json serializable) for ip along with its current show switches state."""
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO devices VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (ip, switch_data.get("Name"), *self._state(switch_data), json.dumps(data), time.time()),
+            )
+            self._db.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
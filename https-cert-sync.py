@@ -5,21 +5,19 @@
 # Version 2020-1.0
 
 
-import socket
 import threading
-import time
 from datetime import datetime, timezone
 from pathlib import Path, PurePath
-from common.arubaos_ssh import Cli
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
-import requests
 # from OpenSSL import crypto  # type: ignore
 # from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.primitives.serialization import pkcs12
-from cryptography.x509.extensions import SubjectAlternativeName
 # from cryptography import x509
 
-from common import AosConnect, config, log, parse
+from common import cert_cache, config, log, parse, resolver
+from common.device import ManagedDevice
+from common.pipeline import CommandPipeline, Stage, StagedPipeline
+from common.scheduler import open_sessions
 
 LOCK = threading.Lock()
 COUNT = 3
@@ -45,6 +43,9 @@ class Certificate:
 
 
 def verify_get_new_cert():
+    from cryptography.hazmat.primitives.serialization import pkcs12
+    from cryptography.x509.extensions import SubjectAlternativeName
+
     if not config.cert.ok:
         raise Exception("Configuration data missing, verify contents of config.yaml")
 
@@ -72,56 +73,27 @@ def verify_get_new_cert():
     return Certificate(data)
 
 
-class ManagedDevice():
-    def __init__(self, data: dict = None, connection=None):
-        if connection:
-            self.connection = connection
-        if data:
-            self.update_data(data)
-
-    def update_data(self, data):
-        if "cert_cn" in data.keys():
-            self.portal = Certificate(data)
-        else:
-            self.name = data.get('Name')
-            self.cfg_id = data.get('Config ID')
-            self.sync_time = data.get('Config Sync Time (sec)')
-            self.cfg_state = data.get('Configuration State')
-            self.ip = data.get('IP Address')
-            self.location = data.get('Location')
-            self.model = data.get('Model')
-            self.status = data.get('Status')
-            self.type = data.get('Type')
-            self.version = data.get('Version')
-
-    def __repr__(self):
-        ret = f" ---- {self.name} ----\n"
-        for k, v in self.__dict__.items():
-            if isinstance(v, (str, int)):
-                ret += f" {k}: {v}\n"
-        return ret
-
-    def _repr_csv_(self):
-        """csv representation
+class Controllers():
+    def __init__(self, conductors, new_cert: Certificate = None, run: bool = True):
+        """Sync the captive portal cert on every MD discovered on conductors.
 
-        Returns:
-            tuple: commas seperated values of class attributes: (keys, values)
+        Args:
+            conductors (List[str]): Conductors, MDs are discovered from their show switches.
+            new_cert (Certificate, optional): The cert to push. Defaults to the p12 in config (cert).
+            run (bool, optional): Run the sync now. Defaults to True.
         """
-        head = ""
-        ret = ""
-        for k, v in self.__dict__.items():
-            if isinstance(v, (str, int)):
-                head += f"{k},"
-                ret += f"{v},"
-        return head.rstrip(','), ret.rstrip(',')
-
-
-class Controllers():
-    def __init__(self, conductors):
         self.conductors = conductors
-        self.new_cert = verify_get_new_cert()
+        self.new_cert = new_cert if new_cert is not None else verify_get_new_cert()
         self.data = {}
-        self.run()
+        self.discovered_on = {}  # MD ip -> conductor it was discovered on
+        self.push_results = {}  # MD ip -> cert push ok
+        self.new_cert_name = f"LE_{datetime.now().strftime('%h%d_%Y')}_2"  # Dec25_2020  Unique enough to ensure no conflicts with previous cert
+        self._imported = set()  # conductors the new cert has been imported on
+        self._pushed: Dict[Tuple[str, str], bool] = {}  # (conductor, config node) -> push result, a node is pushed once
+        self._push_lock = threading.Lock()
+        self._conductor_locks: Dict[str, threading.Lock] = {}
+        if run:
+            self.run()
 
     def run(self):
         ''' Start parallel threads to establish session with Mobility Conductors
@@ -133,148 +105,240 @@ class Controllers():
         if self.data:
             self.exec_api()
         if len(self.data) > start:
-            md_list = [dev for dev in self.data if not hasattr(self.data[dev], 'connection')]
+            md_list = [dev for dev in self.data if self.data[dev].connection is None]
             self.start_controller_threads(md_list)
             self.exec_api(conductor=False)
 
-    def push_new_cert(self, md: ManagedDevice) -> None:
-        new_cert = self.new_cert
-        diff = new_cert.expire_date - md.portal.expire_date
-        # if diff.days > 0:
-        d = datetime.now()
-        time_stamp = d.strftime("%h%d_%Y")  # Dec25_2020  Unique enough to ensure no conflicts with previous cert
-        new_cert_name = f"LE_{time_stamp}_2"
-        # TODO would need to determine this md is associated with this conductor in the event they put multiple in the config.  For now we just use the first one.
-        # might already be handled using self vs config
-        if diff.days != 0:
-            cfg_dict = {
-                "ip": self.conductors[0],
-                "cli_user": config.user,
-                "cli_pass": f"{config.password}",
-                "cmd_list": [
-                    f"copy tftp: {config.cert.tftp_svr} {config.cert.p12_name} flash {new_cert.name}.p12",  # File copied successfully
-                    "conf t",
-                    f"crypto pki-import pkcs12 ServerCert {new_cert_name} {new_cert.name}.p12 {config.cert.p12_pass}",  # Certificate is uploaded. Please execute "crypto-local pki SERVERCERT securelogin.kabrew.com_0412.p12 securelogin.kabrew.com.p12" from a config node
-                    f"cd {config.cert.md_path}",
-                    f"crypto-local pki ServerCert {new_cert_name} {new_cert.name}.p12",
-                    "write mem",  # Configuration Saved
-                    "web-server profile",
-                    f"captive-portal-cert {new_cert_name}"
-                ]
-            }
-            cli = Cli(**cfg_dict)
-            print(cli)
-            log.info("If the Script was done the Cert would be pushed here")
-            # TODO login to mds and # "process restart httpd", "y"
-        else:
+    def needs_cert_update(self, md: ManagedDevice) -> bool:
+        diff = self.new_cert.expire_date - md.portal.expire_date
+        if diff.days == 0:
             log.info(f"{md.name}: No Certificate Update necessary Expiration is the same.")
+            return False
+        return True
 
-    def start_controller_threads(self, devices):
-        """Login/establish session for each controller
+    def config_node(self, md: ManagedDevice) -> str:
+        """Config node the md's cert is set on, cert.md_paths (by md name or ip) else cert.md_path."""
+        md_paths = config.cert.md_paths or {}
+        return md_paths.get(md.name) or md_paths.get(md.ip) or config.cert.md_path
+
+    def plan_cert_push(self, mds: List[ManagedDevice]) -> Dict[str, Dict[str, List[ManagedDevice]]]:
+        """Group the mds needing the new cert by the (already resolved) conductor they were discovered on, then config node.
+
+        Returns:
+            Dict[str, Dict[str, List[ManagedDevice]]]: {conductor: {config node: [mds]}}
         """
-        thread_array = []
-        t = [None] * len(devices)
+        plan: Dict[str, Dict[str, List[ManagedDevice]]] = {}
+        for md in mds:
+            conductor = self.discovered_on.get(md.ip) or resolver.resolve(self.conductors[0])
+            plan.setdefault(conductor, {}).setdefault(self.config_node(md), []).append(md)
+        return plan
 
-        for i, dev in enumerate(devices):
-            _this = (dev, config.user, config.password)
-            thread_array.append(_this)
-            t[i] = threading.Thread(target=self.get_session, args=(_this))
+    def cert_import_command(self, new_cert_name: str) -> str:
+        # Certificate is uploaded. Please execute "crypto-local pki SERVERCERT securelogin.kabrew.com_0412.p12 securelogin.kabrew.com.p12" from a config node
+        return f"crypto pki-import pkcs12 ServerCert {new_cert_name} {self.new_cert.name}.p12 {config.cert.p12_pass}"
 
-            t[i].daemon = True
-            t[i].start()
+    def cert_push_commands(self, nodes: Iterable[str], new_cert_name: str, import_cert: bool = True) -> List[str]:
+        """Commands for one conductor, the cert is copied and imported once then applied at each config node.
 
-            time.sleep(0.5)
+        import_cert=False skips the copy/import, for a conductor the cert was already imported on earlier in the run.
+        """
+        new_cert = self.new_cert
+        cmd_list = [
+            f"copy tftp: {config.cert.tftp_svr} {config.cert.p12_name} flash {new_cert.name}.p12",  # File copied successfully
+            "conf t",
+            self.cert_import_command(new_cert_name),
+        ] if import_cert else ["conf t"]
+        for node in nodes:
+            cmd_list += [
+                f"cd {node}",
+                f"crypto-local pki ServerCert {new_cert_name} {new_cert.name}.p12",
+                "web-server profile",
+                f"captive-portal-cert {new_cert_name}",
+                "exit",
+            ]
+        return [*cmd_list, "write mem"]  # Configuration Saved
+
+    def push_new_cert(self, mds: List[ManagedDevice]) -> Dict[str, bool]:
+        """Push the new cert to every md in mds, one CLI session per conductor regardless of the number of mds.
+
+        Called once per batch from the push stage of exec_api_md, pushes to the same conductor
+        are serialized and the cert is only copied/imported on the first.  A config node is only
+        pushed once per run, mds in a node pushed by an earlier batch get that push's result.
 
-        for thread in t:
-            thread.join()
+        Returns:
+            Dict[str, bool]: push result by md ip.
+        """
+        results: Dict[str, bool] = {}
+        if not mds:
+            return results
+        from common.arubaos_ssh import Cli  # paramiko is only needed if there is something to push
+
+        new_cert_name = self.new_cert_name
+        for conductor, nodes in self.plan_cert_push(mds).items():
+            with self._push_lock:
+                conductor_lock = self._conductor_locks.setdefault(conductor, threading.Lock())
+            with conductor_lock:
+                pushed = {node: self._pushed[(conductor, node)] for node in nodes if (conductor, node) in self._pushed}
+                for node, ok in pushed.items():
+                    for md in nodes[node]:
+                        results[md.ip] = ok
+                        log.info(f"{md.name}:({md.ip}): {node} already pushed via {conductor} {'OK' if ok else 'Failed'}")
+                nodes = {node: members for node, members in nodes.items() if node not in pushed}
+                if not nodes:
+                    continue
+                log.info(
+                    f"{conductor}: pushing {new_cert_name} to {sum(map(len, nodes.values()))} MDs in {len(nodes)} config node(s) "
+                    f"{', '.join(nodes)}"
+                )
+                import_cert = conductor not in self._imported
+                cfg_dict = {
+                    "ip": conductor,
+                    "cli_user": config.user,
+                    "cli_pass": f"{config.password}",
+                    "cmd_list": self.cert_push_commands(nodes, new_cert_name, import_cert=import_cert),
+                }
+                cli = Cli(**cfg_dict)
+                ok = cli.ok  # connected and ran the whole command list
+                if ok and import_cert:
+                    # later pushes to this conductor skip the import, so only trust it if the controller confirmed it
+                    import_out = cli.output(self.cert_import_command(new_cert_name)) or ""
+                    if "certificate is uploaded" in import_out.lower():
+                        self._imported.add(conductor)
+                    else:
+                        log.error(f"{conductor}: import of {new_cert_name} not confirmed: {import_out.strip()}")
+                        ok = False
+                self._pushed.update({(conductor, node): ok for node in nodes})
+            for node, members in nodes.items():
+                for md in members:
+                    results[md.ip] = ok
+                    log.info(f"{md.name}:({md.ip}): cert push via {conductor} {node} {'OK' if ok else 'Failed'}")
+            # TODO login to mds and # "process restart httpd", "y"
+        # the cert changed (or may have), a rerun must not see the old one from the response cache
+        for md in mds:
+            cache = None if md.connection is None else md.connection.response_cache
+            if cache:
+                for cmd in ("show web-server profile", "show crypto pki ServerCert"):
+                    cache.invalidate(md.ip, cmd)
+        return results
 
-    def get_session(self, dev, username, password):
-        try:
-            ip = socket.gethostbyname(dev)
-            con = AosConnect(ip, user=username, password=password)
-            r = con.api_login()
-            if r.ok:
-                log.info(f"{ip}: Session Estabished")
-                if ip not in self.data:
-                    self.data[ip] = ManagedDevice(connection=con)
-                else:
-                    setattr(self.data[ip], 'connection', con)
+    def start_controller_threads(self, devices):
+        """Login/establish session for each controller (see common.scheduler.open_sessions)."""
+        for ip, con in open_sessions(devices).items():
+            if ip not in self.data:
+                self.data[ip] = ManagedDevice(connection=con)
+            else:
+                self.data[ip].connection = con
+
+    def exec_api_md(self, push: bool = False) -> Iterator[ManagedDevice]:
+        """Collect the captive portal cert from every MD with a session, concurrently.
+
+        MDs go through the stages web-server profile -> ServerCert and, with push,
+        compare -> push, each stage with its own workers (cert_sync_workers in config.yaml)
+        and a bounded queue in front of it, so a slow push doesn't hold up collection.
+
+        Yields:
+            ManagedDevice: MDs with their portal cert, or with push the MDs the new cert was pushed to.
+        """
+        workers = config.cert_sync_workers
+        stages = [
+            Stage("profile", self._web_server_profile, workers["profile"]),
+            Stage("cert", self._server_cert, workers["cert"]),
+        ]
+        if push:
+            stages += [
+                Stage("compare", self._compare, workers["compare"]),
+                # batched, every MD queued when a push starts goes in the one CLI session per conductor
+                Stage("push", self._push, workers["push"], batch=config.cert_sync_queue),
+            ]
+        mds = [md for md in self.data.values() if md.connection is not None]
+        yield from StagedPipeline(stages, config.cert_sync_queue).run(mds)
+
+    def _web_server_profile(self, md: ManagedDevice) -> Optional[Tuple[ManagedDevice, str]]:
+        pretty_name = f"{md.name}:({md.ip})"
+        res = md.connection.execute_command("show web-server profile")
+        if not res.ok:
+            return None
+        web_svr_data = parse.show_web_server_profile(res)
+        cert_name = web_svr_data.get("Captive Portal Certificate")
+        if not cert_name:
+            log.error(f"{pretty_name}: No Captive Portal Certificate Returned")
+            md.portal = None
+        elif cert_name == "default":
+            log.info(f"{pretty_name} is using the default certificate... data retrieval skipped")
+            md.portal = None
+        else:
+            return md, cert_name
+        return None
+
+    def _server_cert(self, md_cert: Tuple[ManagedDevice, str]) -> Optional[ManagedDevice]:
+        md, cert_name = md_cert
+        # MDs in the same config node share the cert, only fetch it if the name changed or it's near expiry
+        node = self.config_node(md)
+        with cert_cache.lock(node, cert_name):  # other cert workers wanting the same cert wait for this fetch
+            cert_data = cert_cache.get(node, cert_name)
+            if cert_data:
+                log.debug(f"{md.name}:({md.ip}): {cert_name} details from cert cache ({node})")
             else:
-                log.error(f"{dev}: Failure Establishing Session: {r.error}")
-
-        except socket.gaierror:
-            log.critical(f"{dev}: Unable to resolve host.")
-        except ConnectionRefusedError as e:
-            log.critical(f"{dev}: Unable to connect to Controller. Login Failed.\n{e}")
-        except requests.RequestException as e:
-            log.critical(f"{dev}: Requests Exception {e}")
+                res = md.connection.execute_command(f"show crypto pki ServerCert {cert_name}")
+                cert_data = None if not res.ok else parse.show_crypto_pki_servercert(res)
+                if not cert_data:
+                    log.error(
+                        f"{md.name}:({md.ip}): "
+                        f"No cert data retunred from output of show crypto pki ServerCert {cert_name}"
+                        )
+                    return None
+                cert_cache.set(node, cert_name, cert_data)
+        md.portal = Certificate(cert_data)
+        return md
+
+    def _compare(self, md: ManagedDevice) -> Optional[ManagedDevice]:
+        pretty_name = f"{md.name}:({md.ip})"
+        # Done with API calls close session with Controller
+        try:
+            md.connection.close()
+            log.info(f"{pretty_name}: Session Closed")
         except Exception as e:
-            log.critical(f"{dev}: Exception Occured {e}")
-
-    def exec_api_md(self):
-        for dev in self.data:
-            if hasattr(self.data[dev], "connection"):
-                con = self.data[dev].connection
-                res = con.execute_command("show web-server profile")
-                pretty_name = f"{self.data[dev].name}:({dev})"
-                if res.ok:
-                    web_svr_data = parse.show_web_server_profile(res)
-                    cert_name = web_svr_data.get("Captive Portal Certificate")
-                    if not cert_name:
-                        log.error(f"{pretty_name}: No Captive Portal Certificate Returned")
-                        self.data[dev].portal = None
-                    elif cert_name == "default":
-                        log.info(f"{pretty_name} is using the default certificate... data retrieval skipped")
-                        self.data[dev].portal = None
-                    else:
-                        cert_data = con.execute_command(f"show crypto pki ServerCert {cert_name}")
-                        cert_data = parse.show_crypto_pki_servercert(cert_data)
-                        if not cert_data:
-                            log.error(
-                                f"{pretty_name}: "
-                                f"No cert data retunred from output of show crypto pki ServerCert {cert_name}"
-                                )
-                        else:
-                            self.data[dev].update_data(cert_data)
-                            yield self.data[dev]
+            log.error(f"{pretty_name}: Error on session close {e}")
+        return md if self.needs_cert_update(md) else None
+
+    def _push(self, mds: List[ManagedDevice]) -> List[ManagedDevice]:
+        results = self.push_new_cert(mds)
+        with self._push_lock:
+            self.push_results.update(results)
+        return [md for md in mds if results.get(md.ip)]
 
     def exec_api(self, conductor=True):
         if conductor:
             ''' get all the MDs connect to the Mobility Conductor'''
             for dev in self.data.copy():
-                if self.data[dev].connection.handle:
+                if self.data[dev].connection.logged_in:
                     con = self.data[dev].connection
-                    res = con.execute_command("show switches")
+                    # independent, sent concurrently over the one session
+                    res, vrrp_res = CommandPipeline(con, config.pipeline_concurrency).run(["show switches", "show vrrp"])
                     if res.ok:
                         switch_dict = parse.show_switches(res.json())
                         for ip in switch_dict:
                             if switch_dict[ip]['Type'] in ["MD", "master", "conductor"]:
                                 self.data[ip] = ManagedDevice(data=switch_dict[ip])
+                                self.discovered_on[ip] = dev
                         # Determine if this is VRRP address for MM
                         try:
-                            res = con.execute_command("show vrrp")
+                            res = vrrp_res
                             if res.json().get('_data'):
                                 if dev in '\n'.join(res.json()['_data']):
                                     log.info(
                                         f'Removing MM VRRP addrress ({dev}) from data '
                                         f'- data will include physical addresses'
                                              )
-                                    con.handle.close()
+                                    con.close()
                                     log.info(f"{dev}: Session Closed")
                                     del self.data[dev]
                         except Exception as e:
                             log.error(f"{dev}: Exception occured 'show vrrp' {e}")
         else:
-            for dev in self.exec_api_md():
-                self.push_new_cert(dev)
-                con = dev.connection
-                pretty_name = f"{dev.name}:({dev.ip})"
-                # Done with API calls close session with Controller
-                try:
-                    con.handle.close()
-                    log.info(f"{pretty_name}: Session Closed")
-                except Exception as e:
-                    log.error(f"{pretty_name}: Error on session close {e}")
+            pushed = list(self.exec_api_md(push=True))
+            log.info(f"cert cache: {cert_cache.hits} hits, {cert_cache.misses} misses")
+            log.info(f"New cert pushed to {len(pushed)}/{len(self.push_results)} MDs needing it")
 
 
 if __name__ == "__main__":
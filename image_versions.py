@@ -7,13 +7,17 @@
 # portions of this script based on the work already done by https://github.com/aruba/arubaos8-example-scripts
 
 
-import socket
+import argparse
+import csv
+import os
 import threading
 import time
 
-import requests
-
-from common import AosConnect, config, log, parse
+from common import config, log, parse
+from common.device import ManagedDevice
+from common.pipeline import CommandPipeline
+from common.scheduler import open_sessions
+from common.snapshot import InventorySnapshot
 
 LOCK = threading.Lock()
 COUNT = 3
@@ -21,54 +25,80 @@ controllers = ''
 port = ''
 outfile = 'results.csv'
 outfile2 = 'results.txt'
-config = config.config
-
-
-class ManagedDevice:
-    def __init__(self, data: dict = None, connection=None):
-        if connection:
-            self.connection = connection
-        if data:
-            self.update_data(data)
-
-    def update_data(self, data):
-        self.name = data.get('Name')
-        self.cfg_id = data.get('Config ID')
-        self.sync_time = data.get('Config Sync Time (sec)')
-        self.cfg_state = data.get('Configuration State')
-        self.ip = data.get('IP Address')
-        self.location = data.get('Location')
-        self.model = data.get('Model')
-        self.status = data.get('Status')
-        self.type = data.get('Type')
-        self.version = data.get('Version')
-
-    def __repr__(self):
-        ret = f" ---- {self.name} ----\n"
-        for k, v in self.__dict__.items():
-            if isinstance(v, (str, int)):
-                ret += f" {k}: {v}\n"
-        return ret
-
-    def _repr_csv_(self):
-        """csv representation
-
-        Returns:
-            tuple: commas seperated values of class attributes: (keys, values)
+
+
+class ResultWriter:
+    def __init__(self, csv_file: str = outfile, report_file: str = outfile2, report_interval: float = 1.0):
+        """Streams results to disk as each device reports.
+
+        A row is appended (and flushed) to csv_file for each device using the fixed ManagedDevice.CSV_HEADER schema.
+        The version -> partition report (report_file) is kept in memory as a small index and rewritten
+        at most once every report_interval seconds, and on close.
         """
-        head = ""
-        ret = ""
-        for k, v in self.__dict__.items():
-            if isinstance(v, (str, int)):
-                head += f"{k},"
-                ret += f"{v},"
-        return head.rstrip(','), ret.rstrip(',')
+        self.report_file = report_file
+        self.report_interval = report_interval
+        self.written = set()
+        self.by_version = {}
+        self._last_report = 0
+        self._csv = open(csv_file, "w", newline="")
+        self._writer = csv.writer(self._csv)
+        self._writer.writerow(ManagedDevice.CSV_HEADER)
+        self._csv.flush()
+
+    def write(self, dev: ManagedDevice) -> None:
+        with LOCK:
+            self._writer.writerow(dev.csv_row())
+            self._csv.flush()
+            self.written.add(dev)
+            for part, ver in dev.partitions.items():
+                if ver:
+                    self.by_version.setdefault(ver, []).append((dev.type, dev.name, dev.ip, part, part == dev.default_boot))
+            if time.monotonic() - self._last_report >= self.report_interval:
+                self.write_report()
+
+    def write_report(self) -> None:
+        tmp = f"{self.report_file}.tmp"
+        with open(tmp, "w") as out:
+            rel6 = False
+            for rel in self.by_version:
+                if rel.startswith('6'):
+                    rel6 = True
+                out.write(f"Partitions Containing {rel}\n")
+                for _type, name, ip, partition, default_boot in self.by_version[rel]:
+                    out.write(f"  {_type}: {name}({ip}) Partition: {partition} "
+                              f"{'' if not default_boot else '**default boot**'}\n")
+                out.write('\n')
+            if rel6:
+                out.write(" ** Partitions exist with 6.x **\n")
+            else:
+                out.write(" ** NO partitions exist with 6.x **\n")
+        os.replace(tmp, self.report_file)
+        self._last_report = time.monotonic()
+
+    def close(self) -> None:
+        with LOCK:
+            self.write_report()
+            self._csv.close()
 
 
 class Controllers():
-    def __init__(self, conductors):
+    def __init__(self, conductors, refresh: bool = False):
+        """Collect image versions from the conductors and every MD they manage.
+
+        Args:
+            conductors (list): ip/fqdn of the Mobility Conductors.
+            refresh (bool, optional): Incremental refresh. MDs whose Config ID, Version and Status (per
+                show switches) are unchanged since the last run reuse the stored partition data and are
+                not logged into. Defaults to False (query every MD).
+        """
         self.conductors = conductors
+        self.refresh = refresh
         self.data = {}
+        self.discovered_on = {}  # MD ip -> conductor it was discovered on
+        self.switch_data = {}  # MD ip -> show switches entry
+        self.reused = set()  # MD ips served from the snapshot
+        self.snapshot = InventorySnapshot(config.cache_dir / "inventory.db")
+        self.writer = ResultWriter()
         self.run()
 
     def run(self):
@@ -81,129 +111,75 @@ class Controllers():
         if self.data:
             self.exec_api()
         if len(self.data) > start:
-            md_list = [dev for dev in self.data if not hasattr(self.data[dev], 'connection')]
+            md_list = [dev for dev in self.data if self.data[dev].connection is None and dev not in self.reused]
+            if self.reused:
+                log.info(f"{len(self.reused)} unchanged MDs served from snapshot, querying {len(md_list)}", show=True)
             self.start_controller_threads(md_list)
             self.exec_api(conductor=False)
 
-        with open(outfile, "w") as out:
-            for dev in self.data:
-                out.write(self.data[dev]._repr_csv_()[0] + "\n")
-                break
-            for dev in self.data:
-                out.write(self.data[dev]._repr_csv_()[1] + "\n")
-
-        by_version = {}
-        for dev in self.data:
-            ver0 = self.data[dev].__dict__.get("version 0:0")
-            ver1 = self.data[dev].__dict__.get("version 0:1")
-            if ver0 not in by_version:
-                by_version[ver0] = []
-            if ver1 not in by_version:
-                by_version[ver1] = []
-            _this0 = {'name': self.data[dev].name, 'ip': self.data[dev].ip, 'type': self.data[dev].type}
-            _this1 = {'name': self.data[dev].name, 'ip': self.data[dev].ip, 'type': self.data[dev].type}
-            _this0['default_boot'] = True if '0:0' in self.data[dev].default_boot else False
-            _this1['default_boot'] = True if '0:1' in self.data[dev].default_boot else False
-            _this0['partition'] = '0:0'
-            _this1['partition'] = '0:1'
-            by_version[ver0] += [_this0]
-            by_version[ver1] += [_this1]
-
-        with open(outfile2, "w") as out:
-            rel6 = False
-            for rel in by_version:
-                if rel.startswith('6'):
-                    rel6 = True
-                out.write(f"Partitions Containing {rel}\n")
-                for dev in by_version[rel]:
-                    out.write(f"  {dev['type']}: {dev['name']}({dev['ip']}) Partition: {dev['partition']} "
-                              f"{'' if not dev['default_boot'] else '**default boot**'}\n")
-                out.write('\n')
-            if rel6:
-                out.write(" ** Partitions exist with 6.x **\n")
-            else:
-                out.write(" ** NO partitions exist with 6.x **\n")
+        # devices that never reported (i.e. login failed) still get a row
+        for dev in self.data.values():
+            if dev not in self.writer.written:
+                self.writer.write(dev)
+        self.writer.close()
+        self.snapshot.close()
 
     def start_controller_threads(self, devices):
-        """Login/establish session for each controller
-        """
-        thread_array = []
-        t = [None] * len(devices)
-
-        for i, dev in enumerate(devices):
-            _this = [dev, config['user'], config['pass']]
-            thread_array.append(_this)
-            t[i] = threading.Thread(target=self.get_session, args=(_this))
-
-            t[i].daemon = True
-            t[i].start()
-
-            time.sleep(0.5)
-
-        for thread in t:
-            thread.join()
-
-    def get_session(self, dev, username, password):
-        try:
-            ip = socket.gethostbyname(dev)
-            con = AosConnect(ip, user=username, password=password)
-            r = con.api_login()
-            if r.ok:
-                log.info(f"{ip}: Session Estabished", show=True)
-                if ip not in self.data:
-                    self.data[ip] = ManagedDevice(connection=con)
-                else:
-                    setattr(self.data[ip], 'connection', con)
+        """Login/establish session for each controller (see common.scheduler.open_sessions)."""
+        for ip, con in open_sessions(devices).items():
+            if ip not in self.data:
+                self.data[ip] = ManagedDevice(connection=con)
             else:
-                log.error(f"{dev}: Failure Establishing Session: {r.error}", show=True)
-                # raise r.error.__name__
-        except socket.gaierror:
-            log.critical(f"{dev}: Unable to resolve host.")
-        except ConnectionRefusedError as e:
-            log.critical(f"{dev}: Unable to connect to Controller. Login Failed.\n{e}")
-        except requests.RequestException as e:
-            log.critical(f"{dev}: Requests Exception {e}")
-        except Exception as e:
-            log.critical(f"{dev}: Exception Occured {e}")
+                self.data[ip].connection = con
 
     def exec_api(self, conductor=True):
         if conductor:
             ''' get all the MDs connect to the Mobility Conductor'''
             for dev in self.data.copy():
-                if self.data[dev].connection.handle:
+                if self.data[dev].connection.logged_in:
                     con = self.data[dev].connection
-                    res = con.execute_command("show switches")
+                    # independent, sent concurrently over the one session
+                    res, vrrp_res = CommandPipeline(con, config.pipeline_concurrency).run(["show switches", "show vrrp"])
                     if res.ok:
-                        switch_dict = parse.show_switches(res.json)
+                        switch_dict = parse.show_switches(res.json())
                         for ip in switch_dict:
                             if switch_dict[ip]['Type'] in ["MD", "master"]:
                                 self.data[ip] = ManagedDevice(data=switch_dict[ip])
+                                self.discovered_on[ip] = dev
+                                self.switch_data[ip] = switch_dict[ip]
+                                img_data = None if not self.refresh else self.snapshot.unchanged(ip, switch_dict[ip])
+                                if img_data:
+                                    self.data[ip].update_image(parse.ImageVersion.from_json(img_data))
+                                    self.reused.add(ip)
+                                    self.writer.write(self.data[ip])
                         # Determine if this is VRRP address for MM
                         try:
-                            res = con.execute_command("show vrrp")
-                            if res.json.get('_data'):
-                                if dev in '\n'.join(res.json['_data']):
+                            res = vrrp_res
+                            if res.json().get('_data'):
+                                if dev in '\n'.join(res.json()['_data']):
                                     log.info(f'{dev}: Removing MM VRRP addrress from data - data will include physical addresses')
-                                    con.handle.close()
+                                    con.close()
                                     log.info(f"{dev}: Session Closed", show=True)
                                     del self.data[dev]
                         except Exception as e:
                             log.error(f"{dev}: Exception occured 'show vrrp' {e}")
         else:
             for dev in self.data:
-                if hasattr(self.data[dev], "connection"):
+                if self.data[dev].connection is not None:
                     con = self.data[dev].connection
                     res = con.execute_command("show image version")
                     if res.ok:
-                        img_dict = parse.show_image_version(res.json)
-                        for k, v in img_dict.items():
-                            setattr(self.data[dev], k, v)
+                        image = parse.show_image_version(res.json())
+                        self.data[dev].update_image(image)
+                        if dev in self.switch_data:
+                            self.snapshot.save(dev, self.switch_data[dev], image)
                     else:
                         log.error(f"{dev}: error: ({res.status_code}) {res.error}", show=True)
+                    self.writer.write(self.data[dev])
 
                     # Done with API calls close session with Controller
                     try:
-                        con.handle.close()
+                        con.close()
                         log.info(f"{dev}: Session Closed", show=True)
                     except Exception as e:
                         log.error(f"{dev}: Error on session close {e}")
@@ -211,8 +187,12 @@ class Controllers():
 
 if __name__ == "__main__":
     log.info(f" {'-' * 10 } Script Startup {'-' * 20 }")
-    mcds = config.get('conductors', [])
+    parser = argparse.ArgumentParser(description="Report image versions in each partition of every controller")
+    parser.add_argument("--refresh", action="store_true",
+                        help="Only query MDs whose Config ID, Version or Status changed since the last run")
+    args = parser.parse_args()
+    mcds = config.conductors
     if mcds:
-        Controllers(mcds)
+        Controllers(mcds, refresh=args.refresh)
     else:
         print('No Data, Check config.yaml')
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# common logs to logs/<script>.log beside the calling script (argv[0]), under pytest that would be pytest's package dir
+sys.argv[0] = str(Path(__file__).resolve().parent.parent / "tests.py")
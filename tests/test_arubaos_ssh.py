@@ -0,0 +1,122 @@
+import importlib
+import select
+import socket
+import threading
+import time
+
+import pytest
+
+from common.arubaos_ssh import Cli, prompt_pattern
+
+LOGIN_PROMPT = "(mm1)[mynode]#"  # as captured by Cli.get_prompt (spaces removed)
+
+
+class FakeShell:
+    """Stand-in for the paramiko shell channel, on a socketpair so select works.
+
+    Echoes each command then replies with its output and the prompt, prompts maps
+    a command to the prompt shown after it (others keep the current one), or is
+    called with (command, current prompt) and returns the new prompt.
+    """
+    def __init__(self, prompt: str, prompts: dict = None):
+        self.sock, self._peer = socket.socketpair()
+        self.prompt = prompt
+        self.prompts = prompts or {}
+        self.closed = self.eof_received = False
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        buf = b""
+        while True:
+            data = self._peer.recv(4096)
+            if not data:
+                return
+            buf += data
+            while b"\n" in buf:
+                line, buf = buf.split(b"\n", 1)
+                cmd = line.decode()
+                self.prompt = self.prompts(cmd, self.prompt) if callable(self.prompts) else self.prompts.get(cmd, self.prompt)
+                self._peer.sendall(f"{cmd}\r\noutput of {cmd}\r\n{self.prompt}".encode())
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def recv_ready(self):
+        return bool(select.select([self.sock], [], [], 0)[0])
+
+    def recv(self, n):
+        return self.sock.recv(n)
+
+    def sendall(self, data):
+        self.sock.sendall(data)
+
+
+def cli(shell: FakeShell) -> Cli:
+    c = Cli(ip="10.0.0.1", cmd_timeout=3)  # no credentials, doesn't connect
+    c.shell_chanel = shell
+    c.prompt = LOGIN_PROMPT
+    return c
+
+
+@pytest.mark.parametrize("text", [
+    "(mm1) [mynode] #",
+    "(mm1) [md/site] #",
+    "(mm1) ^[md/site] (config) #",
+    "(mm1) *[md/site] (Web Server Configuration) #",
+    "(mm1) #",
+    "output line\n(mm1) [md] (config-submode)#",
+])
+def test_prompt_pattern_any_node_or_mode(text):
+    assert prompt_pattern(LOGIN_PROMPT).search(text)
+
+
+@pytest.mark.parametrize("text", ["(mm2) [mynode] #", "text (mm1) [mynode] #", "(mm1) [mynode] (config) $"])
+def test_prompt_pattern_other_host_or_not_prompt(text):
+    assert not prompt_pattern(LOGIN_PROMPT).search(text)
+
+
+def test_read_until_returns_on_changed_prompt():
+    c = cli(FakeShell("(mm1) ^[md/site] (config) #"))
+    start = time.monotonic()
+    c.in_channel("show clock")
+    text, ok = c.read_until(prompt_pattern(c.prompt), "show clock")
+    assert ok
+    assert "output of show clock" in text
+    assert time.monotonic() - start < 1  # prompt found, not the deadline
+
+
+def aos8_prompts():
+    """Prompt after each command as an AOS8 conductor shows it, tracking node, mode and pending changes."""
+    state = {"node": "mynode", "mode": None, "pending": ""}
+
+    def _prompt(cmd: str, _: str) -> str:
+        if cmd.startswith("cd "):
+            state["node"] = cmd[3:].strip("/")
+        elif cmd == "conf t":
+            state["mode"] = "config"
+        elif cmd == "web-server profile":
+            state["mode"] = "Web Server Configuration"
+        elif cmd == "exit":
+            state["mode"] = "config"
+        elif cmd.startswith(("crypto-local", "captive-portal-cert")):
+            state["pending"] = "*"
+        elif cmd == "write mem":
+            state["pending"] = ""
+        mode = f"({state['mode']}) " if state["mode"] else ""
+        return f"(mm1) {state['pending']}[{state['node']}] {mode}#"
+
+    return _prompt
+
+
+def test_cert_push_cd_to_other_nodes():
+    cert_sync = importlib.import_module("https-cert-sync")
+    ctl = cert_sync.Controllers(["10.0.0.1"], new_cert=cert_sync.Certificate({"cert_cn": "securelogin.example.com"}), run=False)
+    cmds = ctl.cert_push_commands(["/md/site-a", "/md/site-b"], "LE_Dec25_2020_2")
+    c = cli(FakeShell("(mm1) [mynode] #", aos8_prompts()))
+    start = time.monotonic()
+    out = c.execute_command(cmds)
+    assert not c.fail_msg
+    assert len(out) == len(cmds)  # includes the no paging added in front
+    for cmd, text in zip(cmds, out):
+        assert f"output of {cmd}" in text  # each output is its own command's, not shifted
+    assert time.monotonic() - start < 2  # every prompt matched, no command waited out cmd_timeout
@@ -0,0 +1,73 @@
+"""CommandPipeline chaining, run against a fake connection."""
+import threading
+import time
+
+from common import Response
+from common.pipeline import Command, CommandPipeline
+
+
+class FakeCon:
+    """Stands in for AosConnect, replies "output of <cmd>" and records what was sent."""
+    ip = "10.0.0.1"
+
+    def __init__(self, delay: float = 0):
+        self.delay = delay
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def execute_command(self, cmd: str) -> Response:
+        with self._lock:
+            self.sent.append(cmd)
+        time.sleep(self.delay)
+        return Response(ok=True, output=f"output of {cmd}")
+
+
+def test_chained_command_gets_parent_response():
+    con = FakeCon()
+    seen = []
+
+    def _then(res):
+        seen.append(res.text)
+        return [f"show crypto pki ServerCert {res.text.split()[-1]}"]
+
+    res = CommandPipeline(con).run([Command("show web-server profile", _then)])
+
+    assert seen == ["output of show web-server profile"]
+    assert [r.text for r in res] == [
+        "output of show web-server profile",
+        "output of show crypto pki ServerCert profile",
+    ]
+
+
+def test_chain_of_commands_runs_every_level():
+    con = FakeCon()
+
+    def _level(n):
+        return lambda res: [Command(f"show level {n + 1}", _level(n + 1))] if n < 3 else None
+
+    res = CommandPipeline(con).run([Command("show level 0", _level(0))])
+
+    assert con.sent == [f"show level {n}" for n in range(4)]
+    assert [r.text for r in res] == [f"output of show level {n}" for n in range(4)]
+
+
+def test_chained_follow_submitted_and_duplicates_kept():
+    con = FakeCon(delay=0.01)
+    cmds = [Command("show switches", lambda res: ["show version"]), "show vrrp", "show vrrp"]
+
+    res = CommandPipeline(con, max_concurrent=4).run(cmds)
+
+    assert [r.text for r in res] == [
+        "output of show switches", "output of show vrrp", "output of show vrrp", "output of show version"
+    ]
+
+
+def test_callback_exception_ends_that_chain_only():
+    con = FakeCon()
+
+    def _boom(res):
+        raise ValueError("bad output")
+
+    res = CommandPipeline(con).run([Command("show switches", _boom), Command("show vrrp", lambda res: ["show version"])])
+
+    assert [r.text for r in res] == ["output of show switches", "output of show vrrp", "output of show version"]